@@ -1,12 +1,28 @@
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, IterableDataset, DataLoader, get_worker_info
 import chess
 import chess.pgn
+import chess.polyglot
 import numpy as np
 import os
+import sys
+import math
+import io
+import gc
+import time
+import random
+import json
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
+from collections import OrderedDict
+
+# Plane order of the encoder: white P N B R Q K, then black p n b r q k
+PLANE_PIECES = [(piece_type, color) for color in (chess.WHITE, chess.BLACK) for piece_type in chess.PIECE_TYPES]
+# Same order with chessEngine.GameState piece names
+GAMESTATE_PIECES = ['wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK']
 
 class ChessboardEncoder:
     def __init__(self):
@@ -14,25 +30,45 @@ class ChessboardEncoder:
             'P': 1, 'N': 2, 'B': 3, 'R': 4, 'Q': 5, 'K': 6,
             'p': -1, 'n': -2, 'b': -3, 'r': -4, 'q': -5, 'k': -6
         }
-    
-    def encode_board(self, board):
-        # 13 channels: 12 for pieces + 1 for turn indicator
-        encoded = np.zeros((13, 8, 8), dtype=np.float32)
-        
-        # Encode pieces
-        for i in range(8):
-            for j in range(8):
-                piece = board.piece_at(chess.square(j, i))
-                if piece is not None:
-                    piece_symbol = piece.symbol()
-                    color_idx = 0 if piece.color else 6
-                    piece_type = abs(self.piece_mapping[piece_symbol]) - 1
-                    encoded[piece_type + color_idx][i][j] = 1
-        
+
+    def board_masks(self, board):
+        # 12 piece bitboards in python-chess square order (a1 = bit 0) and the side to move.
+        # Accepts a chess.Board or a chessEngine.GameState (whose bitboards start at a8, so ranks are flipped later)
+        if hasattr(board, 'pieceBitboards'):
+            return [board.pieceBitboards[piece] for piece in GAMESTATE_PIECES], board.whiteToMove
+        return [board.pieces_mask(piece_type, color) for piece_type, color in PLANE_PIECES], board.turn
+
+    def encode_batch(self, boards, out=None):
+        # 13 channels per board: 12 for pieces + 1 for turn indicator.
+        # The piece planes are unpacked from the bitboards in one numpy call; out can be a preallocated
+        # float32 array of shape (N, 13, 8, 8) and the returned tensor shares its memory.
+        n = len(boards)
+        masks = np.empty((n, 12), dtype='<u8')
+        turns = np.empty(n, dtype=np.float32)
+        flipped = np.zeros(n, dtype=bool)
+        for i, board in enumerate(boards):
+            masks[i], turns[i] = self.board_masks(board)
+            flipped[i] = hasattr(board, 'pieceBitboards')
+        return self.encode_masks(masks, turns, out, flipped)
+
+    def encode_masks(self, masks, turns, out=None, flipped=None):
+        # Builds the planes straight from an (N, 12) array of bitboards and N side-to-move flags
+        # (this is also how the preprocessed on-disk store is decoded)
+        masks = np.ascontiguousarray(masks, dtype='<u8')
+        n = len(masks)
+        if out is None:
+            out = np.empty((n, 13, 8, 8), dtype=np.float32)
+        planes = np.unpackbits(masks.view(np.uint8), axis=1, bitorder='little').reshape(n, 12, 8, 8)
+        out[:, :12] = planes
+        if flipped is not None and flipped.any():
+            # GameState rows go from rank 8 down to rank 1
+            out[flipped, :12] = planes[flipped][:, :, ::-1, :]
         # Add turn indicator channel (1 for white, 0 for black)
-        encoded[12].fill(1.0 if board.turn else 0.0)
-        
-        return torch.FloatTensor(encoded)
+        out[:, 12] = np.asarray(turns, dtype=np.float32)[:, None, None]
+        return torch.from_numpy(out)
+
+    def encode_board(self, board):
+        return self.encode_batch([board])[0]
     
 class ChessDataset(Dataset):
     def __init__(self, games):
@@ -49,12 +85,7 @@ class ChessDataset(Dataset):
                 self.turns.append(board.turn)
                 
                 # Encode move based on the current perspective
-                from_square = move.from_square
-                to_square = move.to_square
-                if not board.turn:  # If it's black's turn, flip the move encoding
-                    from_square = chess.square_mirror(from_square)
-                    to_square = chess.square_mirror(to_square)
-                move_idx = from_square * 64 + to_square
+                move_idx = move_to_index(move, board.turn)
                 
                 self.moves.append(move_idx)
                 board.push(move)
@@ -67,8 +98,293 @@ class ChessDataset(Dataset):
         move = torch.LongTensor([self.moves[idx]])
         return position, move
     
+# On-disk training store: one raw little-endian file per field, read back with np.memmap
+STORE_FIELDS = {
+    'boards': ('<u8', (12,)),  # 12 piece bitboards, python-chess square order
+    'moves': ('<i2', ()),      # policy index of the move played
+    'turns': ('u1', ()),       # 1 if white to move
+    'results': ('i1', ()),     # game result from white's point of view: 1, 0 or -1
+}
+RESULTS = {'1-0': 1, '0-1': -1, '1/2-1/2': 0}
+
+def game_records(game):
+    # (bitboards, move index, turn, result) arrays for every position of a game's mainline
+    result = RESULTS.get(game.headers.get('Result'), 0)
+    board = game.board()
+    boards, moves, turns = [], [], []
+    for move in game.mainline_moves():
+        boards.append([board.pieces_mask(piece_type, color) for piece_type, color in PLANE_PIECES])
+        moves.append(move_to_index(move, board.turn))
+        turns.append(board.turn)
+        board.push(move)
+    return {
+        'boards': np.array(boards, dtype='<u8').reshape(-1, 12),
+        'moves': np.array(moves, dtype='<i2'),
+        'turns': np.array(turns, dtype='u1'),
+        'results': np.full(len(moves), result, dtype='i1'),
+    }
+
+class PositionStoreWriter:
+    # Appends position records to a store directory; the count is written to meta.json on close
+    def __init__(self, store_dir):
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self.files = {name: open(self.store_dir / f'{name}.bin', 'wb') for name in STORE_FIELDS}
+        self.count = 0
+
+    def append(self, records):
+        for name, (dtype, _) in STORE_FIELDS.items():
+            self.files[name].write(np.ascontiguousarray(records[name], dtype=dtype).tobytes())
+        self.count += len(records['moves'])
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        with open(self.store_dir / 'meta.json', 'w') as f:
+            json.dump({'count': self.count}, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def preprocess_pgn(pgn_file, store_dir, max_games=None):
+    # One-time conversion of a PGN file into the memory-mapped training store
+    with PositionStoreWriter(store_dir) as writer, open(pgn_file, encoding='utf-8') as f:
+        games = 0
+        while max_games is None or games < max_games:
+            game = chess.pgn.read_game(f)
+            if game is None:
+                break
+            writer.append(game_records(game))
+            games += 1
+    print(f'Stored {writer.count} positions from {games} games in {store_dir}')
+    return writer.count
+
+def split_pgn(pgn_file, num_shards):
+    # Splits a PGN file into byte ranges that each start at a game boundary ("[Event " line)
+    size = os.path.getsize(pgn_file)
+    starts = [0]
+    with open(pgn_file, 'rb') as f:
+        for i in range(1, num_shards):
+            f.seek(max(size * i // num_shards, starts[-1]))
+            f.readline()  # skip the (probably partial) line we landed in
+            while True:
+                offset = f.tell()
+                line = f.readline()
+                if not line or line.startswith(b'[Event '):
+                    break
+            if offset > starts[-1]:
+                starts.append(offset)
+    ends = starts[1:] + [size]
+    return [(start, end) for start, end in zip(starts, ends) if end > start]
+
+def concat_records(chunks):
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) if chunks
+            else np.empty((0,) + shape, dtype=dtype)
+            for name, (dtype, shape) in STORE_FIELDS.items()}
+
+def iter_pgn_games(pgn_file, start=0, end=None):
+    # Streams the games of a byte range one at a time; only the text of the current game is held in memory.
+    # start must be a game boundary (see split_pgn)
+    def parse(lines):
+        # read_game is called until the chunk is exhausted, so a stray blank line inside a game
+        # splits it exactly like a sequential read of the whole file would
+        stream = io.StringIO(b''.join(lines).decode('utf-8', errors='replace'))
+        while True:
+            game = chess.pgn.read_game(stream)
+            if game is None:
+                break
+            yield game
+
+    with open(pgn_file, 'rb') as f:
+        f.seek(start)
+        position = start
+        lines = []
+        for line in f:
+            if end is not None and position >= end:
+                break
+            position += len(line)
+            if line.startswith(b'[Event ') and lines:
+                yield from parse(lines)
+                lines = []
+            lines.append(line)
+        if lines:
+            yield from parse(lines)
+
+def parse_pgn_range(task):
+    # Worker: parses and replays the games of one byte range, returns the records of all of them
+    pgn_file, start, end = task
+    return concat_records([game_records(game) for game in iter_pgn_games(pgn_file, start, end)])
+
+def preprocess_pgn_parallel(pgn_file, store_dir, num_workers=None, shards_per_worker=4):
+    # Same store as preprocess_pgn, with the games parsed in a process pool. There are more shards
+    # than workers so results stream into the store as they finish instead of piling up in memory.
+    num_workers = num_workers or os.cpu_count() or 1
+    ranges = split_pgn(pgn_file, num_workers * shards_per_worker)
+    tasks = [(pgn_file, start, end) for start, end in ranges]
+    with PositionStoreWriter(store_dir) as writer, ProcessPoolExecutor(max_workers=num_workers) as pool:
+        # map keeps the shards in file order so the store matches the sequential one
+        for records in pool.map(parse_pgn_range, tasks):
+            writer.append(records)
+    print(f'Stored {writer.count} positions from {len(ranges)} shards in {store_dir}')
+    return writer.count
+
+def open_store(store_dir):
+    # Read-only np.memmap views of every field of a store
+    store_dir = Path(store_dir)
+    with open(store_dir / 'meta.json') as f:
+        count = json.load(f)['count']
+    if count == 0:
+        # A PGN without games leaves zero-byte files, which np.memmap can't map
+        return concat_records([])
+    return {name: np.memmap(store_dir / f'{name}.bin', dtype=dtype, mode='r', shape=(count,) + shape)
+            for name, (dtype, shape) in STORE_FIELDS.items()}
+
+def value_targets(results, turns):
+    # Game result from the side to move's point of view, the target of the value head
+    return np.where(np.asarray(turns) == 1, results, -np.asarray(results, dtype=np.float32)).astype(np.float32)
+
+class MemmapChessDataset(Dataset):
+    # Same samples as ChessDataset, read lazily from a preprocessed store so RAM stays flat.
+    # with_values=True adds the value target (see value_targets) to every sample
+    def __init__(self, store_dir, with_values=False):
+        self.store_dir = store_dir
+        self.with_values = with_values
+        self.encoder = ChessboardEncoder()
+        self._store = None
+
+    @property
+    def store(self):
+        # The memmaps are opened on first use in each process. They are left out when the dataset is
+        # pickled (DataLoader workers under spawn), so a worker maps the files instead of copying the corpus
+        if self._store is None:
+            self._store = open_store(self.store_dir)
+        return self._store
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_store'] = None
+        return state
+
+    def __len__(self):
+        return len(self.store['moves'])
+
+    def __getitem__(self, idx):
+        position = self.encoder.encode_masks(self.store['boards'][idx:idx + 1], self.store['turns'][idx:idx + 1])[0]
+        move = torch.LongTensor([int(self.store['moves'][idx])])
+        if self.with_values:
+            value = value_targets(self.store['results'][idx:idx + 1], self.store['turns'][idx:idx + 1])
+            return position, move, torch.from_numpy(value)
+        return position, move
+
+    def __getitems__(self, indices):
+        # Batched fetch used by the DataLoader: decodes the whole batch in one call
+        # The store is read in sorted order (friendlier to the page cache), then the samples are put back
+        # in the requested order: sample i has to match indices[i]
+        indices = np.asarray(indices)
+        order = np.argsort(indices, kind='stable')
+        restore = np.empty_like(order)
+        restore[order] = np.arange(len(order))
+        sorted_indices = indices[order]
+        boards = self.store['boards'][sorted_indices][restore]
+        turns = self.store['turns'][sorted_indices][restore]
+        positions = self.encoder.encode_masks(boards, turns)
+        moves = torch.from_numpy(self.store['moves'][sorted_indices][restore].astype(np.int64)).unsqueeze(1)
+        if self.with_values:
+            values = torch.from_numpy(value_targets(self.store['results'][sorted_indices][restore], turns))
+            return list(zip(positions, moves, values.unsqueeze(1)))
+        return list(zip(positions, moves))
+
+class StreamingChessDataset(IterableDataset):
+    # Yields encoded (positions, moves) batches lazily from a PGN file or a preprocessed store directory,
+    # so the corpus never has to fit in RAM. Use it with DataLoader(dataset, batch_size=None).
+    # Each DataLoader worker reads its own shards, and samples go through a bounded shuffle buffer.
+    def __init__(self, source, batch_size=32, shuffle_buffer=10000, seed=0, shards_per_worker=4, block_size=4096,
+                 with_values=False):
+        self.source = source
+        self.with_values = with_values
+        self.batch_size = batch_size
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.shards_per_worker = shards_per_worker
+        self.block_size = block_size
+        self.epoch = 0
+        self.encoder = ChessboardEncoder()
+
+    def set_epoch(self, epoch):
+        # Reshuffles differently every epoch (train_model calls this)
+        self.epoch = epoch
+
+    def records(self, worker_id, num_workers):
+        # (bitboards, move, turn, result) of the positions that belong to this worker
+        if os.path.isdir(self.source):
+            store = open_store(self.source)
+            count = len(store['moves'])
+            for block_start in range(worker_id * self.block_size, count, num_workers * self.block_size):
+                block = slice(block_start, min(block_start + self.block_size, count))
+                yield from zip(store['boards'][block], store['moves'][block], store['turns'][block],
+                               store['results'][block])
+        else:
+            shards = split_pgn(self.source, num_workers * self.shards_per_worker)
+            for start, end in shards[worker_id::num_workers]:
+                for game in iter_pgn_games(self.source, start, end):
+                    records = game_records(game)
+                    yield from zip(records['boards'], records['moves'], records['turns'], records['results'])
+
+    def shuffled(self, records, rng):
+        buffer = []
+        for record in records:
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(record)
+                continue
+            i = rng.randrange(len(buffer))
+            yield buffer[i]
+            buffer[i] = record
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def __iter__(self):
+        worker = get_worker_info()
+        worker_id, num_workers = (worker.id, worker.num_workers) if worker is not None else (0, 1)
+        rng = random.Random(self.seed * 1000003 + self.epoch * 1009 + worker_id)
+        records = self.records(worker_id, num_workers)
+        if self.shuffle_buffer > 1:
+            records = self.shuffled(records, rng)
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) == self.batch_size:
+                yield self.encode(batch)
+                batch = []
+        if batch:
+            yield self.encode(batch)
+
+    def encode(self, batch):
+        boards, moves, turns, results = zip(*batch)
+        positions = self.encoder.encode_masks(np.stack(boards), np.array(turns))
+        moves = torch.from_numpy(np.array(moves, dtype=np.int64)).unsqueeze(1)
+        if self.with_values:
+            return positions, moves, torch.from_numpy(value_targets(np.array(results), np.array(turns))).unsqueeze(1)
+        return positions, moves
+
+class ValueHead(nn.Module):
+    # Predicts the game result from the side to move's point of view, in [-1, 1]
+    def __init__(self, channels):
+        super(ValueHead, self).__init__()
+        self.conv = nn.Conv2d(channels, 4, 1)
+        self.batch_norm = nn.BatchNorm2d(4)
+        self.fc1 = nn.Linear(4 * 8 * 8, 128)
+        self.fc2 = nn.Linear(128, 1)
+        self.relu = nn.ReLU()
+
+    def forward(self, x):
+        x = self.relu(self.batch_norm(self.conv(x))).flatten(1)
+        return torch.tanh(self.fc2(self.relu(self.fc1(x)))).squeeze(1)
+
 class ChessCNN(nn.Module):
-    def __init__(self):
+    def __init__(self, value_head=False):
         super(ChessCNN, self).__init__()
         # Modified to accept 13 input channels (12 piece channels + 1 turn channel)
         self.conv1 = nn.Conv2d(13, 64, 3, padding=1)
@@ -81,43 +397,463 @@ class ChessCNN(nn.Module):
         self.batch_norm2 = nn.BatchNorm2d(128)
         self.batch_norm3 = nn.BatchNorm2d(256)
         self.dropout = nn.Dropout(0.3)
+        # Optional: forward() still returns the policy only, policy_value() adds the value
+        self.value_head = ValueHead(256) if value_head else None
         
-    def forward(self, x):
+    def features(self, x):
         x = self.batch_norm1(self.relu(self.conv1(x)))
         x = self.batch_norm2(self.relu(self.conv2(x)))
-        x = self.batch_norm3(self.relu(self.conv3(x)))
+        return self.batch_norm3(self.relu(self.conv3(x)))
+
+    def policy(self, x):
         x = x.view(-1, 256 * 8 * 8)
         x = self.dropout(self.relu(self.fc1(x)))
         x = self.fc2(x)
         return x
-    
-def get_best_move(model, board, encoder):
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    def forward(self, x):
+        return self.policy(self.features(x))
+
+    def policy_value(self, x):
+        x = self.features(x)
+        return self.policy(x), self.value_head(x)
+
+class ResidualBlock(nn.Module):
+    def __init__(self, channels):
+        super(ResidualBlock, self).__init__()
+        self.conv1 = nn.Conv2d(channels, channels, 3, padding=1, bias=False)
+        self.bn1 = nn.BatchNorm2d(channels)
+        self.conv2 = nn.Conv2d(channels, channels, 3, padding=1, bias=False)
+        self.bn2 = nn.BatchNorm2d(channels)
+        self.relu = nn.ReLU()
+
+    def forward(self, x):
+        out = self.relu(self.bn1(self.conv1(x)))
+        out = self.bn2(self.conv2(out))
+        return self.relu(out + x)
+
+class ChessResNet(nn.Module):
+    # Slimmer alternative to ChessCNN: a residual conv tower and a convolutional policy head.
+    # The head embeds every square twice with 1x1 convs (as a from-square and as a to-square) and
+    # scores move from->to with the dot product of the two embeddings, giving the same 4096 logits
+    # (from_square * 64 + to_square) as ChessCNN without the 16k x 1024 fully connected layer.
+    def __init__(self, channels=64, num_blocks=6, policy_dim=32, value_head=False):
+        super(ChessResNet, self).__init__()
+        self.input_conv = nn.Conv2d(13, channels, 3, padding=1, bias=False)
+        self.input_bn = nn.BatchNorm2d(channels)
+        self.blocks = nn.Sequential(*[ResidualBlock(channels) for _ in range(num_blocks)])
+        self.policy_from = nn.Conv2d(channels, policy_dim, 1)
+        self.policy_to = nn.Conv2d(channels, policy_dim, 1)
+        self.relu = nn.ReLU()
+        self.policy_scale = policy_dim ** -0.5
+        self.value_head = ValueHead(channels) if value_head else None
+
+    def features(self, x):
+        x = self.relu(self.input_bn(self.input_conv(x)))
+        return self.blocks(x)
+
+    def policy(self, x):
+        from_emb = self.policy_from(x).flatten(2)  # (batch, policy_dim, 64 squares)
+        to_emb = self.policy_to(x).flatten(2)
+        logits = torch.bmm(from_emb.transpose(1, 2), to_emb) * self.policy_scale  # (batch, from, to)
+        return logits.flatten(1)
+
+    def forward(self, x):
+        return self.policy(self.features(x))
+
+    def policy_value(self, x):
+        x = self.features(x)
+        return self.policy(x), self.value_head(x)
+
+ARCHITECTURES = {'cnn': ChessCNN, 'resnet': ChessResNet}
+
+def build_model(arch='cnn', state_dict=None, value_head=False):
+    # Builds an architecture by name; with a state dict the sizes (and the value head) are read from its weights
+    if state_dict is not None:
+        value_head = has_value_head(state_dict)
+        if arch == 'resnet':
+            return ChessResNet(
+                channels=state_dict['input_conv.weight'].shape[0],
+                num_blocks=len({key.split('.')[1] for key in state_dict if key.startswith('blocks.')}),
+                policy_dim=state_dict['policy_from.weight'].shape[0],
+                value_head=value_head)
+    return ARCHITECTURES[arch](value_head=value_head)
+
+def has_value_head(state_dict):
+    return any(key.startswith('value_head.') for key in state_dict)
+
+def detect_arch(state_dict):
+    return 'resnet' if 'input_conv.weight' in state_dict else 'cnn'
+
+def move_to_index(move, turn):
+    # Policy index of a move from the side to move's perspective (black moves are mirrored, as in training)
+    from_square = move.from_square
+    to_square = move.to_square
+    if not turn:
+        from_square = chess.square_mirror(from_square)
+        to_square = chess.square_mirror(to_square)
+    return from_square * 64 + to_square
+
+def legal_move_indices(board, promotion=chess.QUEEN):
+    # Maps every legal from/to policy index to its move. The policy has no promotion piece,
+    # so a promotion index maps to the promotion to `promotion` (queen by default).
+    index_to_move = {}
+    for move in board.legal_moves:
+        idx = move_to_index(move, board.turn)
+        if idx not in index_to_move or move.promotion == promotion:
+            index_to_move[idx] = move
+    return index_to_move
+
+def legal_move_mask(index_to_move, device=None):
+    # 4096-wide boolean mask with the legal policy indices set
+    mask = torch.zeros(4096, dtype=torch.bool, device=device)
+    mask[list(index_to_move)] = True
+    return mask
+
+def model_device(model):
+    # Device the model's weights live on. Frozen TorchScript artifacts expose no parameters;
+    # they are CPU-only (see export_quantized)
+    for param in model.parameters():
+        return param.device
+    return torch.device('cpu')
+
+def select_moves(logits, sample=False, temperature=1.0):
+    # Picks one index per row of already masked logits: argmax, or a sample from the softmax
+    if sample:
+        probs = torch.softmax(logits / temperature, dim=1)
+        return torch.multinomial(probs, 1).squeeze(1).tolist()
+    return logits.argmax(dim=1).tolist()
+
+def get_best_move(model, board, encoder, sample=False, temperature=1.0, promotion=chess.QUEEN):
+    # Single masked argmax (or sample) over the legal moves of the position
+    index_to_move = legal_move_indices(board, promotion)
+    if not index_to_move:
+        return None
+    device = model_device(model)
     state = encoder.encode_board(board).unsqueeze(0).to(device)
-    
+
     with torch.no_grad():
         output = model(state)
-        move_probs = torch.softmax(output, dim=1)
-        
-        # Get top 10 moves
-        top_moves = torch.topk(move_probs, 10, dim=1)
-        
-        for move_prob, move_idx in zip(top_moves.values[0], top_moves.indices[0]):
-            from_square = move_idx.item() // 64
-            to_square = move_idx.item() % 64
-            
-            # If playing as black, mirror the moves back
-            if not board.turn:
-                from_square = chess.square_mirror(from_square)
-                to_square = chess.square_mirror(to_square)
-            
-            move = chess.Move(from_square, to_square)
-            if move in board.legal_moves:
-                return move
-        
-        # If no legal moves found in top 10, return first legal move
-        return list(board.legal_moves)[0]
-    
+        output = output.masked_fill(~legal_move_mask(index_to_move, device), float('-inf'))
+        move_idx = select_moves(output, sample, temperature)[0]
+
+    return index_to_move[move_idx]
+
+def get_best_moves(model, boards, encoder, sample=False, temperature=1.0, promotion=chess.QUEEN):
+    # Batched version of get_best_move: one forward pass for all positions, illegal moves masked out.
+    # boards can be chess.Board objects or FEN strings. Returns one move per board (None if it has no legal move).
+    boards = [chess.Board(board) if isinstance(board, str) else board for board in boards]
+    if not boards:
+        return []
+    device = model_device(model)
+    states = encoder.encode_batch(boards).to(device)
+    legal = [legal_move_indices(board, promotion) for board in boards]
+
+    mask = torch.zeros(len(boards), 4096, dtype=torch.bool)
+    rows = [row for row, index_to_move in enumerate(legal) for _ in index_to_move]
+    cols = [idx for index_to_move in legal for idx in index_to_move]
+    mask[rows, cols] = True
+    # Rows without a legal move keep one dummy entry so softmax/argmax stay defined
+    mask[[row for row, index_to_move in enumerate(legal) if not index_to_move], 0] = True
+
+    with torch.no_grad():
+        output = model(states)
+        output = output.masked_fill(~mask.to(device), float('-inf'))
+        best = select_moves(output, sample, temperature)
+
+    return [index_to_move.get(idx) for idx, index_to_move in zip(best, legal)]
+
+class NNEvaluator:
+    """Batched, cached position evaluation with the value head of a policy/value model.
+
+    Values are in [-1, 1] from the side to move's point of view. Positions (chess.Board or
+    chessEngine.GameState) are cached by Zobrist key, so transpositions and re-searches of the same
+    position cost no forward pass. queue() only snapshots the bitboards, so a search can queue the
+    children of a node, undo the moves and evaluate them all with one flush().
+    """
+    def __init__(self, model, encoder=None, cache_size=100000, batch_size=256):
+        if getattr(model, 'value_head', None) is None:
+            raise ValueError('NNEvaluator needs a model built with value_head=True')
+        self.model = model
+        self.encoder = encoder or ChessboardEncoder()
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self.cache = OrderedDict()  # key -> value, least recently used first
+        self.pending = {}  # key -> (masks, turn, flipped)
+        self.hits = 0
+        self.misses = 0
+        self.forward_passes = 0
+
+    def key(self, position):
+        if hasattr(position, 'zobristKey'):
+            return position.zobristKey
+        return chess.polyglot.zobrist_hash(position)
+
+    def cached(self, position):
+        # Value of the position if it was already evaluated, else None (never runs the model)
+        key = self.key(position)
+        value = self.cache.get(key)
+        if value is not None:
+            self.cache.move_to_end(key)  # Least recently used entries are evicted first
+            self.hits += 1
+        return value
+
+    def queue(self, position):
+        key = self.key(position)
+        if key not in self.cache and key not in self.pending:
+            masks, turn = self.encoder.board_masks(position)
+            self.pending[key] = (masks, turn, hasattr(position, 'pieceBitboards'))
+
+    def flush(self):
+        # Evaluates every queued position, batch_size positions per forward pass
+        if not self.pending:
+            return
+        items = list(self.pending.items())
+        self.pending.clear()
+        device = model_device(self.model)
+        for start in range(0, len(items), self.batch_size):
+            chunk = items[start:start + self.batch_size]
+            masks = np.array([entry[0] for _, entry in chunk], dtype='<u8')
+            turns = np.array([entry[1] for _, entry in chunk], dtype=np.float32)
+            flipped = np.array([entry[2] for _, entry in chunk], dtype=bool)
+            states = self.encoder.encode_masks(masks, turns, flipped=flipped).to(device)
+            with torch.no_grad():
+                _, values = self.model.policy_value(states)
+            self.forward_passes += 1
+            self.misses += len(chunk)
+            for (key, _), value in zip(chunk, values.float().tolist()):
+                self.cache[key] = value
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def evaluate_batch(self, positions):
+        for position in positions:
+            self.queue(position)
+        self.flush()
+        values = []
+        for position in positions:
+            key = self.key(position)
+            self.cache.move_to_end(key)
+            values.append(self.cache[key])
+        return values
+
+    def evaluate(self, position):
+        value = self.cached(position)
+        if value is None:
+            value = self.evaluate_batch([position])[0]
+        return value
+
+    def clear(self):
+        self.cache.clear()
+        self.pending.clear()
+
+# Material values in pawns, used for the leaf value when the model has no value head
+MATERIAL_VALUES = {chess.PAWN: 1, chess.KNIGHT: 3, chess.BISHOP: 3, chess.ROOK: 5, chess.QUEEN: 9}
+
+def material_value(board):
+    # Material balance squashed into [-1, 1], from the side to move's point of view
+    score = 0
+    for piece_type, value in MATERIAL_VALUES.items():
+        score += value * (chess.popcount(board.pieces_mask(piece_type, board.turn)) -
+                          chess.popcount(board.pieces_mask(piece_type, not board.turn)))
+    return math.tanh(score / 5)
+
+class MCTSNode:
+    __slots__ = ('prior', 'visits', 'value_sum', 'children', 'terminal_value', 'pending')
+
+    def __init__(self, prior):
+        self.prior = prior
+        self.visits = 0
+        self.value_sum = 0.0  # from the point of view of the side that played the move into this node
+        self.children = None  # move -> MCTSNode once expanded ({} for a finished game)
+        self.terminal_value = None
+        self.pending = False  # queued for evaluation by some thread
+
+class MCTS:
+    """Monte Carlo Tree Search (PUCT) guided by the policy network.
+
+    The policy over the legal moves is the prior of every child. Leaves are evaluated with the value head
+    when the model has one, else with the material balance. Each worker thread selects batch_size leaves
+    (virtual loss keeps them apart), evaluates them in one forward pass and backs the values up; the forward
+    passes release the GIL, so num_threads workers keep several cores busy. The tree is kept between calls,
+    and search() continues from the subtree of the new position when it is within two plies of the old root.
+    """
+    def __init__(self, model, encoder=None, c_puct=1.5, batch_size=16, num_threads=None, virtual_loss=3,
+                 promotion=chess.QUEEN):
+        self.model = model
+        self.encoder = encoder or ChessboardEncoder()
+        self.c_puct = c_puct
+        self.batch_size = batch_size
+        self.num_threads = num_threads or min(4, os.cpu_count() or 1)
+        self.virtual_loss = virtual_loss
+        self.promotion = promotion
+        # Frozen TorchScript artifacts only export forward(), i.e. the policy
+        self.use_value_head = getattr(model, 'value_head', None) is not None and hasattr(model, 'policy_value')
+        self.lock = threading.Lock()
+        self.root = None
+        self.root_board = None
+        self.last_info = {}
+
+    def evaluate(self, boards):
+        # (priors, value) for each board: priors maps the legal moves to their policy probability
+        legal = [legal_move_indices(board, self.promotion) for board in boards]
+        device = model_device(self.model)
+        states = self.encoder.encode_batch(boards).to(device)
+        with torch.no_grad():
+            if self.use_value_head:
+                logits, values = self.model.policy_value(states)
+                values = values.float().tolist()
+            else:
+                logits = self.model(states)
+                values = [material_value(board) for board in boards]
+            logits = logits.float().cpu()
+        results = []
+        for row, index_to_move in enumerate(legal):
+            indices = list(index_to_move)
+            probs = torch.softmax(logits[row, indices], dim=0).tolist() if indices else []
+            results.append(({index_to_move[idx]: prob for idx, prob in zip(indices, probs)}, values[row]))
+        return results
+
+    def terminal_value(self, board):
+        # Value for the side to move if the game is over, else None
+        if board.is_insufficient_material() or board.halfmove_clock >= 100:
+            return 0.0
+        if any(True for _ in board.generate_legal_moves()):
+            return None
+        return -1.0 if board.is_check() else 0.0
+
+    def select_child(self, node):
+        sqrt_visits = math.sqrt(max(node.visits, 1))
+        best_score, best = -float('inf'), None
+        for move, child in node.children.items():
+            q = child.value_sum / child.visits if child.visits else 0.0
+            score = q + self.c_puct * child.prior * sqrt_visits / (1 + child.visits)
+            if score > best_score:
+                best_score, best = score, (move, child)
+        return best
+
+    def select_leaf(self, root_board):
+        # Walks down from the root applying virtual loss; returns (path, board), or None on a collision
+        # with a leaf another thread is already evaluating
+        node, board, path = self.root, root_board.copy(stack=False), [self.root]
+        while node.children:
+            move, node = self.select_child(node)
+            board.push(move)
+            node.visits += self.virtual_loss
+            node.value_sum -= self.virtual_loss
+            path.append(node)
+        if node.pending:
+            self.backup(path, None)
+            return None
+        return path, board
+
+    def backup(self, path, value):
+        # value is from the point of view of the side to move at the leaf; None only removes the virtual loss
+        for depth, node in enumerate(reversed(path)):
+            if node is not self.root:
+                node.visits -= self.virtual_loss
+                node.value_sum += self.virtual_loss
+            if value is not None:
+                node.visits += 1
+                node.value_sum += -value if depth % 2 == 0 else value
+
+    def expand(self, node, priors):
+        node.children = {move: MCTSNode(prior) for move, prior in priors.items()}
+
+    def run_batch(self, root_board):
+        leaves = []
+        with self.lock:
+            for _ in range(self.batch_size):
+                selected = self.select_leaf(root_board)
+                if selected is None:
+                    continue
+                path, board = selected
+                leaf = path[-1]
+                if leaf.children is None:
+                    leaf.terminal_value = self.terminal_value(board)
+                    if leaf.terminal_value is not None:
+                        leaf.children = {}
+                if leaf.terminal_value is not None:
+                    self.backup(path, leaf.terminal_value)
+                    continue
+                leaf.pending = True
+                leaves.append((path, board))
+        if not leaves:
+            return
+        results = self.evaluate([board for _, board in leaves])  # outside the lock: other threads keep selecting
+        with self.lock:
+            for (path, _), (priors, value) in zip(leaves, results):
+                leaf = path[-1]
+                self.expand(leaf, priors)
+                leaf.pending = False
+                self.backup(path, value)
+
+    def reuse_subtree(self, board):
+        # The node of `board` if it is the old root or one of its expanded children or grandchildren
+        if self.root is None:
+            return None
+        key = chess.polyglot.zobrist_hash(board)
+        frontier = [(self.root, self.root_board)]
+        for _ in range(3):
+            next_frontier = []
+            for node, node_board in frontier:
+                if chess.polyglot.zobrist_hash(node_board) == key and node.children is not None:
+                    return node
+                for move, child in (node.children or {}).items():
+                    if child.children is not None:
+                        child_board = node_board.copy(stack=False)
+                        child_board.push(move)
+                        next_frontier.append((child, child_board))
+            frontier = next_frontier
+        return None
+
+    def search(self, board, playouts=800, time_limit=None):
+        # Runs until `playouts` new simulations are done or time_limit seconds pass (either can be None).
+        # Returns the most visited move, or None if the game is over
+        if playouts is None and time_limit is None:
+            raise ValueError('search needs a playout or a time budget')
+        if isinstance(board, str):
+            board = chess.Board(board)
+        board = board.copy(stack=False)
+        start = time.perf_counter()
+        self.root = self.reuse_subtree(board)
+        reused = self.root.visits if self.root is not None else 0
+        self.root_board = board
+        if self.root is None:
+            self.root = MCTSNode(1.0)
+            if self.terminal_value(board) is not None:
+                return None
+            priors, value = self.evaluate([board])[0]
+            self.expand(self.root, priors)
+            self.backup([self.root], value)
+        if not self.root.children:
+            return None
+        target = self.root.visits + playouts if playouts is not None else None
+        deadline = start + time_limit if time_limit is not None else None
+
+        def worker():
+            while (target is None or self.root.visits < target) and \
+                    (deadline is None or time.perf_counter() < deadline):
+                self.run_batch(board)
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(self.num_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        move, child = max(self.root.children.items(), key=lambda item: item[1].visits)
+        elapsed = time.perf_counter() - start
+        playouts_done = self.root.visits - reused
+        self.last_info = {'playouts': playouts_done, 'reused': reused, 'time': elapsed,
+                          'playouts_per_sec': int(playouts_done / max(elapsed, 1e-9)),
+                          'visits': child.visits, 'value': child.value_sum / max(child.visits, 1), 'move': move}
+        return move
+
+    def clear(self):
+        self.root = None
+        self.root_board = None
+
 def load_chess_data(pgn_file, max_games=100):
     games = []
     with open(pgn_file, encoding='utf-8') as f:
@@ -128,67 +864,428 @@ def load_chess_data(pgn_file, max_games=100):
             games.append(game)
     return games
 
-def train_model(model, train_loader, num_epochs=5):
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+def make_data_loader(dataset, batch_size=256, num_workers=None, pin_memory=None, prefetch_factor=4, shuffle=True):
+    # DataLoader tuned for throughput: worker processes with prefetching, and pinned memory when
+    # batches go to a GPU. Streaming datasets already yield whole batches, so batch_size/shuffle are theirs.
+    if num_workers is None:
+        num_workers = min(4, os.cpu_count() or 1)
+    if pin_memory is None:
+        pin_memory = get_device().type == 'cuda'
+    kwargs = {'num_workers': num_workers, 'pin_memory': pin_memory}
+    if num_workers > 0:
+        # Persistent workers keep their own copy of the dataset, so set_epoch() would never reach them
+        # and every epoch would replay the same shuffle; those datasets get fresh workers each epoch
+        kwargs.update(prefetch_factor=prefetch_factor, persistent_workers=not hasattr(dataset, 'set_epoch'))
+    if isinstance(dataset, IterableDataset):
+        return DataLoader(dataset, batch_size=None, **kwargs)
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, **kwargs)
+
+def cpu_copy(obj):
+    # Deep copy of a (nested) state dict with every tensor cloned to the CPU, so training can keep
+    # updating the live tensors while the copy is written in the background
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {key: cpu_copy(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(cpu_copy(value) for value in obj)
+    return obj
+
+class CheckpointManager:
+    # Writes checkpoints on a background thread, atomically (temp file + rename) so a crash never leaves
+    # a truncated file, and keeps only the newest keep_last (at least 1) of them.
+    # Files are named {prefix}_{epoch}_{batches}.pt with (epoch, batches) the position training resumes from.
+    def __init__(self, directory='.', prefix='chess_model_checkpoint', keep_last=3):
+        if keep_last < 1:
+            raise ValueError(f'keep_last must be at least 1, got {keep_last}')
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.prefix = prefix
+        self.keep_last = keep_last
+        self.executor = ThreadPoolExecutor(max_workers=1)  # one writer keeps saves in order
+        self.pending = None
+
+    def checkpoints(self):
+        # (epoch, batches, path) of every complete checkpoint, oldest first
+        found = []
+        for path in self.directory.glob(f'{self.prefix}_*_*.pt'):
+            parts = path.stem[len(self.prefix) + 1:].split('_')
+            if len(parts) == 2 and all(part.isdigit() for part in parts):
+                found.append((int(parts[0]), int(parts[1]), path))
+        return sorted(found)
+
+    def save(self, state, epoch, batches=0):
+        self.wait()  # surfaces errors of the previous write and bounds memory to one snapshot in flight
+        snapshot = cpu_copy(state)
+        path = self.directory / f'{self.prefix}_{epoch:04d}_{batches:08d}.pt'
+        self.pending = self.executor.submit(self.write, snapshot, path)
+
+    def write(self, snapshot, path):
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            torch.save(snapshot, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        for _, _, old_path in self.checkpoints()[:-self.keep_last]:
+            old_path.unlink(missing_ok=True)
+
+    def wait(self):
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            pending.result()
+
+    def load_latest(self, map_location=None):
+        self.wait()
+        found = self.checkpoints()
+        if not found:
+            return None
+        # Checkpoints only hold tensors and plain Python values, so the restricted unpickler can read them
+        return torch.load(found[-1][2], map_location=map_location, weights_only=True)
+
+    def close(self):
+        self.wait()
+        self.executor.shutdown()
+
+def train_model(model, train_loader, num_epochs=5, accumulation_steps=1, use_bf16=False,
+                checkpoint_every=1, save_optimizer=True, log_every=10,
+                checkpoint_manager=None, checkpoint_every_batches=0, resume=False, seed=0, value_weight=1.0):
+    # accumulation_steps: batches whose gradients are summed before each optimizer step
+    # use_bf16: run the forward pass under bfloat16 autocast (works on CPU)
+    # checkpoint_every: save a checkpoint every N epochs (0 disables), save_optimizer adds the optimizer state
+    # log_every: the loss stays on the device and is only read back every log_every batches
+    # checkpoint_every_batches: also checkpoint inside an epoch every N batches
+    # resume: continue from the newest checkpoint of checkpoint_manager (model, optimizer, scheduler, epoch and batch)
+    # seed: the data order of epoch e is seeded with seed + e, so a resumed epoch replays the same batches
+    # value_weight: weight of the value head's MSE loss, used when batches carry value targets
+    device = get_device()
     model = model.to(device)
     optimizer = optim.Adam(model.parameters(), lr=0.001)
     criterion = nn.CrossEntropyLoss()
+    value_criterion = nn.MSELoss()
     scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, 'min', patience=2)
+    non_blocking = device.type == 'cuda'
+    if checkpoint_manager is None:
+        checkpoint_manager = CheckpointManager()
+
+    start_epoch, skip_batches, progress = 0, 0, None
+    if resume:
+        checkpoint = checkpoint_manager.load_latest(map_location=device)
+        if checkpoint is not None:
+            model.load_state_dict(checkpoint['model_state_dict'])
+            if 'optimizer_state_dict' in checkpoint:
+                optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+            scheduler.load_state_dict(checkpoint['scheduler_state_dict'])
+            start_epoch, skip_batches = checkpoint['epoch'], checkpoint['batches']
+            progress = checkpoint.get('progress')
+            print(f'Resuming from epoch {start_epoch}, batch {skip_batches}')
+
+    def save_checkpoint(epoch, batches, avg_loss=None, progress=None):
+        checkpoint = {
+            'epoch': epoch,
+            'batches': batches,
+            'model_state_dict': model.state_dict(),
+            'scheduler_state_dict': scheduler.state_dict(),
+            'loss': avg_loss,
+            'progress': progress,
+        }
+        if save_optimizer:
+            checkpoint['optimizer_state_dict'] = optimizer.state_dict()
+        checkpoint_manager.save(checkpoint, epoch, batches)
     
-    for epoch in range(num_epochs):
+    for epoch in range(start_epoch, num_epochs):
         model.train()
-        total_loss = 0
+        total_loss = torch.zeros((), device=device)
+        num_batches = 0
+        num_samples = 0
+        if progress is not None:
+            # Loss statistics of the part of the epoch done before the interruption
+            total_loss += progress['total_loss']
+            num_batches, num_samples = progress['num_batches'], progress['num_samples']
+            progress = None
+        start_time = time.perf_counter()
+        samples_at_start = num_samples
+        if hasattr(train_loader.dataset, 'set_epoch'):
+            train_loader.dataset.set_epoch(epoch)
+        torch.manual_seed(seed + epoch)  # fixes the shuffle order of the epoch
         
-        for batch_idx, (positions, moves) in enumerate(train_loader):
-            positions = positions.to(device)
-            moves = moves.to(device).squeeze()
+        optimizer.zero_grad(set_to_none=True)
+        for batch_idx, (positions, moves, *values) in enumerate(train_loader):
+            if batch_idx < skip_batches:
+                continue  # already trained on before the interruption
+            positions = positions.to(device, non_blocking=non_blocking)
+            moves = moves.to(device, non_blocking=non_blocking).squeeze(1)
+            train_value = bool(values) and getattr(model, 'value_head', None) is not None
             
-            optimizer.zero_grad()
-            output = model(positions)
-            loss = criterion(output, moves)
-            loss.backward()
-            optimizer.step()
+            with torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=use_bf16):
+                if train_value:
+                    output, value = model.policy_value(positions)
+                else:
+                    output = model(positions)
+            loss = criterion(output.float(), moves)
+            if train_value:
+                targets = values[0].to(device, non_blocking=non_blocking).squeeze(1)
+                loss = loss + value_weight * value_criterion(value.float(), targets)
+            (loss / accumulation_steps).backward()
+            if (batch_idx + 1) % accumulation_steps == 0:
+                optimizer.step()
+                optimizer.zero_grad(set_to_none=True)
+                if checkpoint_every_batches and (batch_idx + 1) % checkpoint_every_batches == 0:
+                    save_checkpoint(epoch, batch_idx + 1, progress={
+                        'total_loss': total_loss.item() + loss.item(),
+                        'num_batches': num_batches + 1, 'num_samples': num_samples + positions.size(0)})
             
-            total_loss += loss.item()
+            total_loss += loss.detach()
+            num_batches += 1
+            num_samples += positions.size(0)
             
-            if batch_idx % 10 == 0:
+            if batch_idx % log_every == 0:
                 print(f'Epoch {epoch}, Batch {batch_idx}, Loss: {loss.item():.4f}')
+        skip_batches = 0
+        
+        if num_batches % accumulation_steps != 0:
+            # Apply the gradients of the last incomplete accumulation window
+            optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
         
-        avg_loss = total_loss / len(train_loader)
+        elapsed = time.perf_counter() - start_time
+        avg_loss = total_loss.item() / max(num_batches, 1)  # streaming loaders have no len()
         scheduler.step(avg_loss)
-        print(f'Epoch {epoch} complete - Average Loss: {avg_loss:.4f}')
+        print(f'Epoch {epoch} complete - Average Loss: {avg_loss:.4f} - '
+              f'{(num_samples - samples_at_start) / elapsed:.0f} samples/sec')
         
-        # Save model checkpoint
-        torch.save({
-            'epoch': epoch,
-            'model_state_dict': model.state_dict(),
-            'optimizer_state_dict': optimizer.state_dict(),
-            'loss': avg_loss,
-        }, f'chess_model_checkpoint_{epoch}.pt')
+        # Save model checkpoint (it resumes at the start of the next epoch)
+        if checkpoint_every and (epoch + 1) % checkpoint_every == 0:
+            save_checkpoint(epoch + 1, 0, avg_loss)
     
+    checkpoint_manager.wait()
     return model
 
-def main():
-    # Load data
-    games = load_chess_data("Andreikin.pgn", max_games=1000)
-    dataset = ChessDataset(games)
-    train_loader = DataLoader(dataset, batch_size=32, shuffle=True)
+def main(arch='cnn'):
+    # Load data (the PGN is converted to the memory-mapped store on the first run only)
+    store_dir = "Andreikin_store"
+    if not os.path.exists(os.path.join(store_dir, 'meta.json')):
+        preprocess_pgn("Andreikin.pgn", store_dir, max_games=1000)
+    dataset = MemmapChessDataset(store_dir)
+    train_loader = make_data_loader(dataset, batch_size=256)
     
-    # Create and train model
-    model = ChessCNN()
-    trained_model = train_model(model, train_loader, num_epochs=10)
+    # Create and train model ('cnn' is the original ChessCNN, 'resnet' the slimmer ChessResNet)
+    model = build_model(arch)
+    checkpoints = CheckpointManager('checkpoints', keep_last=3)
+    trained_model = train_model(model, train_loader, num_epochs=10, use_bf16=True, checkpoint_every=2,
+                                checkpoint_manager=checkpoints, checkpoint_every_batches=500, resume=True)
+    checkpoints.close()
     
     # Save final model
     torch.save(trained_model.state_dict(), 'chess_model_final.pt')
 
 
-def load_model(model_path):
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    model = ChessCNN().to(device)
-    model.load_state_dict(torch.load(model_path, weights_only=True))
+_device = None
+
+def get_device():
+    # Device detection is done once and reused by every loaded model
+    global _device
+    if _device is None:
+        _device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    return _device
+
+def quantized_path(model_path):
+    # Where export_quantized puts the artifact of a float checkpoint: chess_model_hard.pt -> chess_model_hard.int8.ts
+    return str(Path(model_path).with_suffix('.int8.ts'))
+
+def export_quantized(model_path, out_path=None, quantize=True, arch=None):
+    # Converts a float checkpoint into a frozen TorchScript artifact for CPU inference, with the Linear
+    # layers dynamically quantized to int8 (ChessCNN's fc1/fc2 hold almost all of its weights)
+    model = load_model(model_path, arch, use_quantized=False).cpu()
+    if getattr(model, 'value_head', None) is not None:
+        # Tracing only records forward(), so the artifact would lose policy_value() and the value head
+        raise ValueError(f'{model_path} has a value head, which a traced artifact cannot keep')
+    if quantize:
+        model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    example = torch.zeros(1, 13, 8, 8)
+    with torch.no_grad():
+        scripted = torch.jit.freeze(torch.jit.trace(model, example))
+    if out_path is None:
+        out_path = quantized_path(model_path) if quantize else str(Path(model_path).with_suffix('.ts'))
+    torch.jit.save(scripted, out_path)
+    print(f'Exported {model_path} to {out_path} ({os.path.getsize(out_path) / 2**20:.1f} MB)')
+    return out_path
+
+def load_scripted(model_path):
+    model = torch.jit.load(model_path, map_location='cpu')
     model.eval()
     return model
 
+def load_model(model_path, arch=None, use_quantized=True):
+    # arch is 'cnn' or 'resnet'; by default it is detected from the checkpoint's weights.
+    # A TorchScript artifact (.ts) is loaded directly. On CPU hosts the quantized artifact next to a float
+    # checkpoint is preferred when it exists, and the float checkpoint is the fallback if it can't be loaded.
+    # Checkpoints with a value head always load in float: the traced artifact only has the policy.
+    device = get_device()
+    if str(model_path).endswith('.ts'):
+        return load_scripted(model_path)
+    # mmap: only the pages that are used get read, so checking the keys is cheap when the artifact wins
+    state_dict = torch.load(model_path, map_location=device, weights_only=True, mmap=True)
+    if use_quantized and device.type == 'cpu' and not has_value_head(state_dict):
+        artifact = quantized_path(model_path)
+        if os.path.exists(artifact):
+            try:
+                return load_scripted(artifact)
+            except Exception as e:
+                print(f'Could not load {artifact} ({e}), falling back to {model_path}')
+    model = build_model(arch or detect_arch(state_dict), state_dict).to(device)
+    model.load_state_dict(state_dict)
+    model.eval()
+    return model
+
+def windows_rss_mb():
+    # Working set of this process from GetProcessMemoryInfo (the resource module doesn't exist on Windows)
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    get_current_process = ctypes.windll.kernel32.GetCurrentProcess
+    get_current_process.restype = wintypes.HANDLE
+    get_memory_info = ctypes.windll.psapi.GetProcessMemoryInfo
+    get_memory_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), wintypes.DWORD]
+    if not get_memory_info(get_current_process(), ctypes.byref(counters), counters.cb):
+        raise ctypes.WinError()
+    return counters.WorkingSetSize / 2**20
+
+def current_rss_mb():
+    # Resident set size of this process (Linux /proc, the working set on Windows, peak RSS elsewhere)
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return windows_rss_mb()
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on the other Unixes
+    return max_rss / 2**20 if sys.platform == 'darwin' else max_rss / 1024
+
+def benchmark_variants(model_path, runs=50):
+    # Per-move latency (get_best_move, encoding included) and RSS growth of the float model and of the
+    # quantized TorchScript artifact (exported first if it doesn't exist yet)
+    artifact = quantized_path(model_path)
+    if not os.path.exists(artifact):
+        export_quantized(model_path, artifact)
+    encoder = ChessboardEncoder()
+    board = chess.Board()
+    results = {}
+    # The smaller variant goes first so it can't reuse memory freed by the bigger one
+    for name, loader in (('int8 torchscript', lambda: load_scripted(artifact)),
+                         ('float32', lambda: load_model(model_path, use_quantized=False).cpu())):
+        gc.collect()
+        rss_before = current_rss_mb()
+        model = loader()
+        get_best_move(model, board, encoder)  # warm-up (TorchScript optimizes on the first calls)
+        get_best_move(model, board, encoder)
+        rss_mb = current_rss_mb() - rss_before
+        start = time.perf_counter()
+        for _ in range(runs):
+            get_best_move(model, board, encoder)
+        latency_ms = (time.perf_counter() - start) / runs * 1000
+        results[name] = {'latency_ms': latency_ms, 'rss_mb': rss_mb}
+        print(f'{name}: {latency_ms:.2f} ms/move, +{rss_mb:.1f} MB RSS')
+        del model
+    return results
+
+def model_footprint(model):
+    # (parameter count, size in MB of parameters and buffers)
+    params = sum(p.numel() for p in model.parameters())
+    size = sum(t.numel() * t.element_size() for t in list(model.parameters()) + list(model.buffers()))
+    return params, size / 2**20
+
+def compare_models(models, dataset=None, num_positions=2048, batch_size=256, latency_runs=50):
+    # Prints parameter count, memory, single-position latency, batched throughput and (given a dataset of
+    # (position, move) samples) top-1 move-prediction accuracy for each {name: model}
+    results = {}
+    sample = torch.zeros(1, 13, 8, 8, device=get_device())
+    for name, model in models.items():
+        model = model.to(get_device()).eval()
+        params, size_mb = model_footprint(model)
+        with torch.no_grad():
+            model(sample)  # warm-up
+            start = time.perf_counter()
+            for _ in range(latency_runs):
+                model(sample)
+            latency_ms = (time.perf_counter() - start) / latency_runs * 1000
+            batch = sample.expand(batch_size, -1, -1, -1).contiguous()
+            start = time.perf_counter()
+            model(batch)
+            throughput = batch_size / (time.perf_counter() - start)
+            accuracy = None
+            if dataset is not None:
+                loader = DataLoader(torch.utils.data.Subset(dataset, range(min(num_positions, len(dataset)))),
+                                    batch_size=batch_size)
+                correct = total = 0
+                for positions, moves, *_ in loader:
+                    predicted = model(positions.to(get_device())).argmax(dim=1).cpu()
+                    correct += (predicted == moves.squeeze(1)).sum().item()
+                    total += len(moves)
+                accuracy = correct / max(total, 1)
+        results[name] = {'params': params, 'size_mb': size_mb, 'latency_ms': latency_ms,
+                         'positions_per_sec': throughput, 'accuracy': accuracy}
+        accuracy_text = f'{accuracy:.3f}' if accuracy is not None else 'n/a'
+        print(f'{name}: {params / 1e6:.2f}M params, {size_mb:.1f} MB, {latency_ms:.2f} ms/move, '
+              f'{throughput:.0f} positions/s (batch {batch_size}), top-1 accuracy {accuracy_text}')
+    return results
+
+MODEL_PATHS = {
+    0: 'Model/chess_model_easy.pt',
+    1: 'Model/chess_model_mid.pt',
+    2: 'Model/chess_model_hard.pt',
+}
+
+class ModelRegistry:
+    """Loads each difficulty's checkpoint once, on first use, and hands out the same eval-mode instance afterwards."""
+    def __init__(self, model_paths=MODEL_PATHS):
+        self.model_paths = dict(model_paths)
+        self.models = {}
+        self.lock = threading.Lock()
+
+    def get(self, difficulty):
+        model = self.models.get(difficulty)
+        if model is None:
+            with self.lock:
+                # Another thread may have loaded it while we waited for the lock
+                model = self.models.get(difficulty)
+                if model is None:
+                    model = load_model(self.model_paths[difficulty])
+                    self.models[difficulty] = model
+        return model
+
+    def warm_up(self, difficulties=None):
+        # Load the checkpoints and run one dummy forward pass so the first real move pays no setup cost.
+        # By default every difficulty whose checkpoint exists is warmed up (engineAPI.loadOpponent does this)
+        if difficulties is None:
+            difficulties = [difficulty for difficulty, path in self.model_paths.items() if os.path.exists(path)]
+        dummy = torch.zeros(1, 13, 8, 8, device=get_device())
+        with torch.no_grad():
+            for difficulty in difficulties:
+                self.get(difficulty)(dummy)
+
+    def unload(self, difficulty=None):
+        with self.lock:
+            if difficulty is None:
+                self.models.clear()
+            else:
+                self.models.pop(difficulty, None)
+
+model_registry = ModelRegistry()
+
 def test_model():
     model = load_model('./chess_model_final.pt')
     encoder = ChessboardEncoder()
@@ -207,16 +1304,27 @@ def test_model():
         print(board)
         print("\n")
 
+_encoder = ChessboardEncoder()
+
+# Difficulties that search with MCTS instead of playing the policy's top move, and their budgets.
+# Only Model_makeMove (and engineAPI.modelMove) play through the network: the pygame GUI's difficulty
+# buttons pick chessAI.DIFFICULTY_BUDGETS for the alpha-beta search and never reach this
+MCTS_BUDGETS = {
+    2: {'playouts': 1600, 'time_limit': 5.0},
+}
+_mcts_players = {}
+
 def Model_makeMove(board,difficulty):
-    if difficulty == 0:
-        model = load_model('Model/chess_model_easy.pt')
-    if difficulty == 1:
-        model = load_model('Model/chess_model_mid.pt')
-    if difficulty == 2:
-        model = load_model('Model/chess_model_hard.pt')
-    encoder = ChessboardEncoder()
+    model = model_registry.get(difficulty)
+    encoder = _encoder
     board= chess.Board(board)
     print(board)
+    if difficulty in MCTS_BUDGETS:
+        # One tree per difficulty, so the subtree of the previous move is reused
+        player = _mcts_players.get(difficulty)
+        if player is None or player.model is not model:
+            player = _mcts_players[difficulty] = MCTS(model, encoder)
+        return player.search(board, **MCTS_BUDGETS[difficulty])
     move = get_best_move(model, board, encoder)
     return move
 
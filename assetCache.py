@@ -0,0 +1,67 @@
+"""Loads every image, font and rendered text once and hands out the same surface afterwards #
+   images are convert()ed / convert_alpha()ed to the display format and scaled once, so blitting them is cheap #
+"""
+import pygame as p
+
+FONT_PATH = "assets/font.ttf"
+PIECES = ['wp','wR', 'wN','wB','wK','wQ','bp','bR','bN','bB','bK','bQ']
+
+images = {} #(path, size, alpha) -> surface
+fonts = {} #(path or system name, size, bold, italic) -> font
+texts = {} #(font, text, antialias, color) -> surface
+
+'''
+the image at path, scaled to size (width, height) if given
+alpha keeps per pixel transparency (convert_alpha), photos without transparency are faster with alpha=False
+'''
+def getImage(path, size=None, alpha=True):
+    key = (path, size, alpha)
+    image = images.get(key)
+    if image is None:
+        image = p.image.load(path)
+        if p.display.get_surface() is not None: #converting needs the display mode to be set
+            image = image.convert_alpha() if alpha else image.convert()
+        if size is not None:
+            image = p.transform.scale(image, size)
+        images[key] = image
+    return image
+
+def getFont(size, path=FONT_PATH):
+    key = (path, size, False, False)
+    font = fonts.get(key)
+    if font is None:
+        font = fonts[key] = p.font.Font(path, size)
+    return font
+
+def getSysFont(name, size, bold=False, italic=False):
+    key = (name, size, bold, italic)
+    font = fonts.get(key)
+    if font is None:
+        font = fonts[key] = p.font.SysFont(name, size, bold, italic)
+    return font
+
+'''text rendered with a font from getFont/getSysFont, memoized by (font, text, antialias, color)'''
+def renderText(font, text, color, antialias=True):
+    key = (font, text, antialias, tuple(p.Color(color)))
+    surface = texts.get(key)
+    if surface is None:
+        surface = texts[key] = font.render(text, antialias, color)
+    return surface
+
+'''the piece images at square size, keyed like GameState.board'''
+def getPieceImages(squareSize):
+    return {piece: getImage("images/" + piece + ".png", (squareSize, squareSize)) for piece in PIECES}
+
+'''load the assets of the menus and the board up front, so the first frame of each screen doesn't stall'''
+def preload(squareSize):
+    getPieceImages(squareSize)
+    getImage("assets/background.jpg", alpha=False)
+    for path, size in (("assets/sans.png", (50, 50)), ("assets/napstablook.jpeg", (45, 45)), ("assets/mettatone.png", (60, 60))):
+        getImage(path, size)
+    for size in (35, 50):
+        getFont(size)
+
+def clear():
+    images.clear()
+    fonts.clear()
+    texts.clear()
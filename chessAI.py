@@ -0,0 +1,423 @@
+"""Alpha-beta search on top of chessEngine.GameState #
+   negamax + iterative deepening, quiescence search and move ordering (MVV-LVA, killer moves, history heuristic) #
+"""
+import time
+import queue
+import threading
+import traceback
+from array import array
+from chessEngine import PIECES, iterBits
+
+PIECE_VALUES = {'p': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 0}
+MATE_SCORE = 100000
+INFINITY = 1000000
+
+#piece-square tables from white's point of view, indexed like the bitboards (row*8 + col, a8 first).
+#black pieces read them mirrored (sq ^ 56)
+PIECE_SQUARE_TABLES = {
+    'p': [  0,  0,  0,  0,  0,  0,  0,  0,
+           50, 50, 50, 50, 50, 50, 50, 50,
+           10, 10, 20, 30, 30, 20, 10, 10,
+            5,  5, 10, 25, 25, 10,  5,  5,
+            0,  0,  0, 20, 20,  0,  0,  0,
+            5, -5,-10,  0,  0,-10, -5,  5,
+            5, 10, 10,-20,-20, 10, 10,  5,
+            0,  0,  0,  0,  0,  0,  0,  0],
+    'N': [-50,-40,-30,-30,-30,-30,-40,-50,
+          -40,-20,  0,  0,  0,  0,-20,-40,
+          -30,  0, 10, 15, 15, 10,  0,-30,
+          -30,  5, 15, 20, 20, 15,  5,-30,
+          -30,  0, 15, 20, 20, 15,  0,-30,
+          -30,  5, 10, 15, 15, 10,  5,-30,
+          -40,-20,  0,  5,  5,  0,-20,-40,
+          -50,-40,-30,-30,-30,-30,-40,-50],
+    'B': [-20,-10,-10,-10,-10,-10,-10,-20,
+          -10,  0,  0,  0,  0,  0,  0,-10,
+          -10,  0,  5, 10, 10,  5,  0,-10,
+          -10,  5,  5, 10, 10,  5,  5,-10,
+          -10,  0, 10, 10, 10, 10,  0,-10,
+          -10, 10, 10, 10, 10, 10, 10,-10,
+          -10,  5,  0,  0,  0,  0,  5,-10,
+          -20,-10,-10,-10,-10,-10,-10,-20],
+    'R': [  0,  0,  0,  0,  0,  0,  0,  0,
+            5, 10, 10, 10, 10, 10, 10,  5,
+           -5,  0,  0,  0,  0,  0,  0, -5,
+           -5,  0,  0,  0,  0,  0,  0, -5,
+           -5,  0,  0,  0,  0,  0,  0, -5,
+           -5,  0,  0,  0,  0,  0,  0, -5,
+           -5,  0,  0,  0,  0,  0,  0, -5,
+            0,  0,  0,  5,  5,  0,  0,  0],
+    'Q': [-20,-10,-10, -5, -5,-10,-10,-20,
+          -10,  0,  0,  0,  0,  0,  0,-10,
+          -10,  0,  5,  5,  5,  5,  0,-10,
+           -5,  0,  5,  5,  5,  5,  0, -5,
+            0,  0,  5,  5,  5,  5,  0, -5,
+          -10,  5,  5,  5,  5,  5,  0,-10,
+          -10,  0,  5,  0,  0,  0,  0,-10,
+          -20,-10,-10, -5, -5,-10,-10,-20],
+    'K': [-30,-40,-40,-50,-50,-40,-40,-30,
+          -30,-40,-40,-50,-50,-40,-40,-30,
+          -30,-40,-40,-50,-50,-40,-40,-30,
+          -30,-40,-40,-50,-50,-40,-40,-30,
+          -20,-30,-30,-40,-40,-30,-30,-20,
+          -10,-20,-20,-20,-20,-20,-20,-10,
+           20, 20,  0,  0,  0,  0, 20, 20,
+           20, 30, 10,  0,  0, 10, 30, 20],
+}
+
+#search budgets for the difficulty levels of chessMain.ai_menu (0 = easy, 1 = normal, 2 = hard)
+DIFFICULTY_BUDGETS = {
+    0: {'timeLimit': 0.5, 'maxDepth': 2},
+    1: {'timeLimit': 2.0, 'maxDepth': 4},
+    2: {'timeLimit': 5.0, 'maxDepth': 64},
+}
+
+'''
+Static evaluation in centipawns from the point of view of the side to move
+'''
+def evaluate(gs):
+    score = 0
+    for piece in PIECES:
+        value = PIECE_VALUES[piece[1]]
+        table = PIECE_SQUARE_TABLES[piece[1]]
+        if piece[0] == 'w':
+            for sq in iterBits(gs.pieceBitboards[piece]):
+                score += value + table[sq]
+        else:
+            for sq in iterBits(gs.pieceBitboards[piece]):
+                score -= value + table[sq ^ 56]
+    return score if gs.whiteToMove else -score
+
+
+#bound types stored in the transposition table
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2
+
+class TranspositionTable():
+    '''
+    Fixed size hash table keyed by GameState.zobristKey. Memory is allocated once (two flat arrays of 64-bit words)
+    so it stays flat however long the game lasts.
+    Every bucket has two slots: slot 0 keeps the deepest entry of the current search (depth-preferred),
+    slot 1 takes everything slot 0 refuses (always-replace). Entries from older searches count as empty.
+    '''
+    ENTRY_BYTES = 16 #8 for the key, 8 for the packed data
+    SCORE_OFFSET = 1 << 21 #scores are stored unsigned in 22 bits
+
+    def __init__(self, sizeMB=16):
+        self.numBuckets = max(1, sizeMB * 1024 * 1024 // (2 * self.ENTRY_BYTES))
+        self.keys = array('Q', bytes(8 * 2 * self.numBuckets))
+        self.data = array('Q', bytes(8 * 2 * self.numBuckets))
+        self.age = 0
+
+    '''call once per search so entries left by previous moves become replaceable'''
+    def newSearch(self):
+        self.age = (self.age + 1) & 0xFF
+
+    '''empty the table by allocating zeroed arrays (looping over millions of slots in Python takes seconds)'''
+    def clear(self):
+        self.keys = array('Q', bytes(8 * len(self.keys)))
+        self.data = array('Q', bytes(8 * len(self.data)))
+        self.age = 0
+
+    '''
+    data layout: bits 0-21 score, 22-23 bound, 24-31 depth, 32-39 age, 40-55 moveID + 1 (0 means no move)
+    '''
+    def pack(self, depth, score, bound, moveID):
+        move = moveID + 1 if moveID is not None else 0
+        return (score + self.SCORE_OFFSET) | bound << 22 | max(depth, 0) << 24 | self.age << 32 | move << 40
+
+    '''returns (depth, score, bound, moveID) or None'''
+    def probe(self, key):
+        index = (key % self.numBuckets) * 2
+        keys = self.keys
+        if keys[index] != key:
+            index += 1
+            if keys[index] != key:
+                return None
+        data = self.data[index]
+        move = data >> 40 & 0xFFFF
+        return data >> 24 & 0xFF, (data & 0x3FFFFF) - self.SCORE_OFFSET, data >> 22 & 0b11, move - 1 if move else None
+
+    def store(self, key, depth, score, bound, moveID):
+        index = (key % self.numBuckets) * 2
+        data = self.data[index]
+        if (self.keys[index] == key or depth >= (data >> 24 & 0xFF) or (data >> 32 & 0xFF) != self.age):
+            if moveID is None and self.keys[index] == key: #keep the best move we already knew about
+                move = data >> 40 & 0xFFFF
+                moveID = move - 1 if move else None
+        else:
+            index += 1 #depth-preferred slot refused, use the always-replace slot
+        self.keys[index] = key
+        self.data[index] = self.pack(depth, score, bound, moveID)
+
+
+class SearchTimeout(Exception):
+    '''raised inside the tree when the time or node budget runs out'''
+
+
+#centipawns per unit of a value network's output (which lies in [-1, 1])
+VALUE_SCALE = 1000
+
+class Searcher():
+    '''
+    evaluator: optional batched position evaluator (e.g. Model.opponent.NNEvaluator) with queue/flush/cached.
+    The children of every depth 1 node are queued and evaluated in one call, and quiescence takes its stand pat
+    score from the evaluator at every leaf (a position that wasn't queued costs its own forward pass), so scores
+    of one search are all on the value network's scale and never mixed with the static evaluation
+    '''
+    def __init__(self, ttSizeMB=16, evaluator=None):
+        self.evaluator = evaluator
+        self.tt = TranspositionTable(ttSizeMB) #kept between moves so transpositions from earlier searches still hit
+        self.killers = [] #two killer moveIDs per ply
+        self.history = {} #(pieceMoved, endSquare) -> bonus from quiet moves that caused a cutoff
+        self.nodes = 0
+        self.deadline = None
+        self.maxNodes = None
+        self.stopEvent = None
+        self.lastInfo = {}
+
+    '''
+    Iterative deepening: searches depth 1, 2, 3... until the time/node budget or maxDepth is reached
+    and returns the best move of the last completed iteration
+    '''
+    def findBestMove(self, gs, validMoves=None, timeLimit=None, maxNodes=None, maxDepth=64, verbose=True, stopEvent=None):
+        rootMoves = list(validMoves if validMoves is not None else gs.getValidMoves()) #reordered below, so never the cached list
+        if not rootMoves: #lastInfo still has to describe this position, not the previous search
+            self.lastInfo = {'depth': 0, 'score': -MATE_SCORE if gs.checkMate else 0, 'nodes': 0, 'time': 0.0,
+                             'nps': 0, 'move': None}
+            return None
+        checkMate, staleMate = gs.checkMate, gs.staleMate #getValidMoves inside the tree overwrites them
+        rootLength = len(gs.moveLog)
+        self.killers = [[None, None] for _ in range(maxDepth + 64)]
+        self.history = {}
+        self.nodes = 0
+        self.maxNodes = maxNodes
+        self.stopEvent = stopEvent #setting it from another thread aborts the search like a timeout
+        self.tt.newSearch()
+        startTime = time.perf_counter()
+        self.deadline = startTime + timeLimit if timeLimit is not None else None
+        bestMove, bestScore, completedDepth = rootMoves[0], 0, 0
+        for depth in range(1, maxDepth + 1):
+            if stopEvent is not None and stopEvent.is_set():
+                break
+            try:
+                score, move = self.searchRoot(gs, rootMoves, depth)
+            except SearchTimeout:
+                while len(gs.moveLog) > rootLength: #unwind the moves left on the board by the aborted iteration
+                    gs.undoMove()
+                break
+            bestMove, bestScore, completedDepth = move, score, depth
+            rootMoves.remove(move) #search the best move first in the next iteration
+            rootMoves.insert(0, move)
+            if verbose:
+                print(f"depth {depth} score {score} nodes {self.nodes} best {move.getChessNotation()}")
+            if abs(score) >= MATE_SCORE - 1000: #found a forced mate, deeper search won't change it
+                break
+        gs.checkMate, gs.staleMate = checkMate, staleMate
+        elapsed = time.perf_counter() - startTime
+        self.lastInfo = {'depth': completedDepth, 'score': bestScore, 'nodes': self.nodes, 'time': elapsed,
+                         'nps': int(self.nodes / elapsed) if elapsed > 0 else 0, 'move': bestMove}
+        if verbose:
+            print(f"searched {self.nodes} nodes in {elapsed:.2f}s ({self.lastInfo['nps']} nodes/s)")
+        return bestMove
+
+    def searchRoot(self, gs, moves, depth):
+        alpha = -INFINITY
+        bestMove = moves[0]
+        for move in moves:
+            gs.makeMove(move)
+            score = -self.negamax(gs, depth - 1, -INFINITY, -alpha, 1)
+            gs.undoMove()
+            if score > alpha:
+                alpha = score
+                bestMove = move
+        return alpha, bestMove
+
+    def checkLimits(self):
+        if self.maxNodes is not None and self.nodes >= self.maxNodes:
+            raise SearchTimeout()
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchTimeout()
+        if self.stopEvent is not None and self.stopEvent.is_set():
+            raise SearchTimeout()
+
+    def negamax(self, gs, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.checkLimits()
+        if isRepetition(gs):
+            return 0
+        inCheck = gs.inCheck()
+        if inCheck:
+            depth += 1 #check extension
+        if depth <= 0:
+            return self.quiescence(gs, alpha, beta, ply)
+        hashMove = None
+        entry = self.tt.probe(gs.zobristKey)
+        if entry is not None:
+            entryDepth, entryScore, bound, hashMove = entry
+            if entryDepth >= depth:
+                entryScore = scoreFromTable(entryScore, ply)
+                if bound == EXACT:
+                    return entryScore
+                if bound == LOWER_BOUND and entryScore >= beta:
+                    return entryScore
+                if bound == UPPER_BOUND and entryScore <= alpha:
+                    return entryScore
+        history = self.history
+        #moves are generated stage by stage, so a cutoff on the hash move or a capture never builds the quiet moves
+        moves = gs.generateMoves(hashMove, self.killers[ply],
+                                 quietKey=lambda move: history.get((move.pieceMoved, move.endRow*8 + move.endCol), 0))
+        if depth == 1 and self.evaluator is not None:
+            moves = list(moves)
+            for move in moves:
+                gs.makeMove(move)
+                self.evaluator.queue(gs)
+                gs.undoMove()
+            self.evaluator.flush()
+        originalAlpha = alpha
+        bestScore = -INFINITY
+        bestMove = None
+        for move in moves:
+            gs.makeMove(move)
+            score = -self.negamax(gs, depth - 1, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if score > bestScore:
+                bestScore = score
+                bestMove = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if move.pieceCaptured == '--':
+                            self.storeKiller(move, ply)
+                            key = (move.pieceMoved, move.endRow*8 + move.endCol)
+                            self.history[key] = self.history.get(key, 0) + depth*depth
+                        break
+        if bestMove is None: #no legal move
+            return -MATE_SCORE + ply if inCheck else 0
+        if bestScore >= beta:
+            bound = LOWER_BOUND
+        elif bestScore > originalAlpha:
+            bound = EXACT
+        else:
+            bound = UPPER_BOUND
+            bestMove = None #no move raised alpha, so none of them is known to be best
+        self.tt.store(gs.zobristKey, depth, scoreToTable(bestScore, ply), bound, bestMove.moveID if bestMove else None)
+        return bestScore
+
+    '''only captures and promotions are searched, so the static evaluation isn't taken in the middle of an exchange'''
+    def quiescence(self, gs, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes & 1023 == 0:
+            self.checkLimits()
+        standPat = self.staticEval(gs)
+        if standPat >= beta:
+            return standPat
+        if standPat > alpha:
+            alpha = standPat
+        for move in gs.generateMoves(capturesOnly=True):
+            gs.makeMove(move)
+            score = -self.quiescence(gs, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    '''value network score of the position when there is an evaluator, else the static evaluation'''
+    def staticEval(self, gs):
+        if self.evaluator is not None:
+            return int(self.evaluator.evaluate(gs) * VALUE_SCALE)
+        return evaluate(gs)
+
+    def storeKiller(self, move, ply):
+        killers = self.killers[ply]
+        if killers[0] != move.moveID:
+            killers[1] = killers[0]
+            killers[0] = move.moveID
+
+
+'''mate scores are stored relative to the node (not the root) so they stay valid when reached through another path'''
+def scoreToTable(score, ply):
+    if score >= MATE_SCORE - 1000:
+        return score + ply
+    if score <= -MATE_SCORE + 1000:
+        return score - ply
+    return score
+
+def scoreFromTable(score, ply):
+    if score >= MATE_SCORE - 1000:
+        return score - ply
+    if score <= -MATE_SCORE + 1000:
+        return score + ply
+    return score
+
+'''the position already happened with the same side to move (a repetition needs at least 4 plies)'''
+def isRepetition(gs):
+    return gs.zobristKey in gs.zobristLog[-5::-2]
+
+
+class AIWorker():
+    '''
+    runs Searcher.findBestMove on a background thread so the window keeps drawing while the engine thinks
+    start() hands over a copy of the position, the main loop calls poll() every frame until it returns the move,
+    cancel() drops the running search (undo, reset) and ponder() searches the position while the player thinks:
+    its result is thrown away but the transposition table it fills makes the next start() faster.
+    ponder() takes the budget of the next start(): a deeper ponder would leave deeper entries that start() trusts.
+    A search that raises posts a None move with the error in lastInfo['error']
+    '''
+    def __init__(self, searcher=None):
+        self.searcher = searcher if searcher is not None else Searcher()
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.jobID = 0
+        self.stopEvent = threading.Event()
+        self.thinking = False #a start() search is running, its move hasn't been polled yet
+        self.lastInfo = {}
+        threading.Thread(target=self.run, daemon=True).start() #daemon: a running search never blocks quitting
+
+    def run(self):
+        while True:
+            jobID, gs, budget, stopEvent, ponder = self.jobs.get()
+            if stopEvent.is_set():
+                continue #cancelled before it started
+            try:
+                move = self.searcher.findBestMove(gs, verbose=False, stopEvent=stopEvent, **budget)
+                info = self.searcher.lastInfo
+            except Exception as e: #the thread has to survive, and poll() has to hear about it or thinking never ends
+                traceback.print_exc()
+                move, info = None, {'error': repr(e)}
+            if not ponder:
+                self.results.put((jobID, move, info))
+
+    def submit(self, gs, budget, ponder):
+        self.cancel()
+        self.jobID += 1
+        self.stopEvent = threading.Event()
+        self.jobs.put((self.jobID, gs.copy(), budget, self.stopEvent, ponder))
+
+    def start(self, gs, **budget):
+        self.submit(gs, budget, False)
+        self.thinking = True
+
+    def ponder(self, gs, **budget):
+        self.submit(gs, budget, True)
+
+    '''
+    the move of the search started last, or None while it is still thinking (results of cancelled searches are dropped)
+    a search that failed also returns None, but thinking is False afterwards
+    '''
+    def poll(self):
+        while True:
+            try:
+                jobID, move, info = self.results.get_nowait()
+            except queue.Empty:
+                return None
+            if jobID == self.jobID and self.thinking:
+                self.thinking = False
+                self.lastInfo = info
+                return move
+
+    def cancel(self):
+        self.stopEvent.set()
+        self.thinking = False
@@ -2,6 +2,129 @@
    2 - responsible for determining the valid moves at the current state. It will also keep a move log #
 """ 
 # use numpy arrays for better performence with AI 
+import random
+import copy
+
+
+# Bitboards: every square is one bit of a python int, indexed row*8 + col (same orientation as
+# GameState.board), so bit 0 is a8 and bit 63 is h1.
+PIECES = ('wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK')
+COLOR_PIECES = {'w': PIECES[:6], 'b': PIECES[6:]}
+CODE_PIECES = ('--',) + PIECES #4 bit piece codes of Move.packed, 0 is an empty square
+PIECE_CODES = {piece: code for code, piece in enumerate(CODE_PIECES)}
+SQUARE_NAMES = ['abcdefgh'[sq & 7] + str(8 - (sq >> 3)) for sq in range(64)] #a8, b8, ... h1
+FEN_PIECES = {piece: piece[1].upper() if piece[0] == 'w' else piece[1].lower() for piece in PIECES}
+FEN_TO_PIECE = {char: piece for piece, char in FEN_PIECES.items()}
+
+'''square name like 'e4' -> (row, col) of GameState.board'''
+def notationToCoords(square):
+    return 8 - int(square[1]), 'abcdefgh'.index(square[0])
+
+def iterBits(bb):
+    '''yields the index of every set bit, lowest first'''
+    while bb:
+        low = bb & -bb
+        yield low.bit_length() - 1
+        bb ^= low
+
+def stepTargets(r, c, steps):
+    mask = 0
+    for dr, dc in steps:
+        endRow, endCol = r + dr, c + dc
+        if 0 <= endRow <= 7 and 0 <= endCol <= 7:
+            mask |= 1 << (endRow*8 + endCol)
+    return mask
+
+KNIGHT_STEPS = ((-1,-2),(-1,2),(1,-2),(1,2),(-2,-1),(-2,1),(2,-1),(2,1))
+KING_STEPS = ((-1,0),(0,-1),(1,0),(0,1),(-1,-1),(-1,1),(1,-1),(1,1))
+KNIGHT_ATTACKS = [stepTargets(sq >> 3, sq & 7, KNIGHT_STEPS) for sq in range(64)]
+KING_ATTACKS = [stepTargets(sq >> 3, sq & 7, KING_STEPS) for sq in range(64)]
+#squares attacked by a pawn of the given color standing on sq (white pawns move up, towards row 0)
+PAWN_ATTACKS = {'w': [stepTargets(sq >> 3, sq & 7, ((-1,-1),(-1,1))) for sq in range(64)],
+                'b': [stepTargets(sq >> 3, sq & 7, ((1,-1),(1,1))) for sq in range(64)]}
+
+#sliding directions, the first four are rook directions and the last four bishop directions
+DIRECTIONS = ((-1,0),(0,-1),(1,0),(0,1),(-1,-1),(-1,1),(1,-1),(1,1))
+ROOK_DIRECTIONS = (0, 1, 2, 3)
+BISHOP_DIRECTIONS = (4, 5, 6, 7)
+#rays going towards higher square indices find their first blocker with the lowest set bit
+POSITIVE_DIRECTION = tuple(dr*8 + dc > 0 for dr, dc in DIRECTIONS)
+
+def rayMask(r, c, dr, dc):
+    mask = 0
+    for i in range(1, 8):
+        endRow, endCol = r + dr*i, c + dc*i
+        if not (0 <= endRow <= 7 and 0 <= endCol <= 7):
+            break
+        mask |= 1 << (endRow*8 + endCol)
+    return mask
+
+RAYS = [[rayMask(sq >> 3, sq & 7, dr, dc) for sq in range(64)] for dr, dc in DIRECTIONS]
+ALL_SQUARES = (1 << 64) - 1
+RANK_MASKS = [0xFF << (8*r) for r in range(8)] #indexed by board row, row 0 is rank 8
+
+def betweenMasks():
+    #BETWEEN[a][b] holds the squares strictly between a and b when they share a line, 0 otherwise
+    between = [[0] * 64 for _ in range(64)]
+    for sq in range(64):
+        for dr, dc in DIRECTIONS:
+            r, c = sq >> 3, sq & 7
+            mask = 0
+            for i in range(1, 8):
+                endRow, endCol = r + dr*i, c + dc*i
+                if not (0 <= endRow <= 7 and 0 <= endCol <= 7):
+                    break
+                between[sq][endRow*8 + endCol] = mask
+                mask |= 1 << (endRow*8 + endCol)
+    return between
+
+BETWEEN = betweenMasks()
+
+# Zobrist keys: a position's key is the xor of one random 64-bit number per feature of the position.
+# The generator is seeded so keys stay the same between runs (and can be stored in tables/caches).
+zobristRandom = random.Random(2024)
+ZOBRIST_PIECES = {piece: [zobristRandom.getrandbits(64) for _ in range(64)] for piece in PIECES}
+ZOBRIST_BLACK_TO_MOVE = zobristRandom.getrandbits(64)
+ZOBRIST_CASTLING = [zobristRandom.getrandbits(64) for _ in range(16)] #one per combination of the 4 rights
+ZOBRIST_ENPASSANT = [zobristRandom.getrandbits(64) for _ in range(8)] #one per file
+
+def castlingKey(rights):
+    return ZOBRIST_CASTLING[rights.wks | rights.bks << 1 | rights.wqs << 2 | rights.bqs << 3]
+
+def enpassantKey(square):
+    return ZOBRIST_ENPASSANT[square[1]] if square else 0
+
+def slidingAttacks(sq, occupied, directions):
+    '''squares reached from sq along the given directions, stopping on (and including) the first blocker'''
+    attacks = 0
+    for d in directions:
+        ray = RAYS[d][sq]
+        blockers = ray & occupied
+        if blockers:
+            if POSITIVE_DIRECTION[d]:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            ray ^= RAYS[d][blocker]
+        attacks |= ray
+    return attacks
+
+def rookAttacks(sq, occupied):
+    return slidingAttacks(sq, occupied, ROOK_DIRECTIONS)
+
+def bishopAttacks(sq, occupied):
+    return slidingAttacks(sq, occupied, BISHOP_DIRECTIONS)
+
+#capture ordering of GameState.generateMoves: most valuable victim first, least valuable attacker as the tie-break
+CAPTURE_VALUES = {'p': 1, 'N': 3, 'B': 3, 'R': 5, 'Q': 9, 'K': 0, '-': 0}
+
+def mvvLva(move):
+    score = 10*CAPTURE_VALUES[move.pieceCaptured[1]] - CAPTURE_VALUES[move.pieceMoved[1]]
+    if move.isPawnPromotion:
+        score += 10*CAPTURE_VALUES['Q']
+    return score
+
+
 class GameState(): 
     def __init__(self):
         #first character represents color second character represents type
@@ -31,31 +154,174 @@ class GameState():
         self.currentCastlingRight= CastleRights(True,True,True,True)
         self.castlingRightsLog = [CastleRights(self.currentCastlingRight.wks,self.currentCastlingRight.bks,
                                                self.currentCastlingRight.wqs,self.currentCastlingRight.bqs)]
+        #bitboards mirror self.board: one mask per piece, one per color and one for every occupied square
+        self.pieceBitboards = {}
+        self.colorBitboards = {}
+        self.occupied = 0
+        self.zobristKey = 0
+        self.loadBitboards()
+        self.enpassantPossibleLog = [self.enpassantPossible]
+        self.zobristLog = [self.zobristKey] #one key per position, kept alongside moveLog
+        #getValidMoves result of the last position it was called on, and its moves indexed by origin square
+        #both are keyed by zobristKey, so any makeMove/undoMove invalidates them
+        self.validMovesCache = None #(zobristKey, moves, checkMate, staleMate)
+        self.movesByOrigin = None #(zobristKey, {(startRow, startCol): {(endRow, endCol): move}})
+        #move counters of the position moveLog starts from (set by loadFen), getFen counts on from them
+        self.startHalfmoveClock = 0
+        self.startFullmoveNumber = 1
+        self.startWhiteToMove = True
+
+    '''independent copy of the game (board, logs and bitboards), e.g. for a search running on another thread'''
+    def copy(self):
+        return copy.deepcopy(self)
+
+    '''
+    FEN of the position, the move counters continue from those of the loaded FEN
+    '''
+    def getFen(self):
+        rows = []
+        for row in self.board:
+            fenRow, empty = '', 0
+            for piece in row:
+                if piece == '--':
+                    empty += 1
+                    continue
+                if empty:
+                    fenRow += str(empty)
+                    empty = 0
+                fenRow += FEN_PIECES[piece]
+            rows.append(fenRow + (str(empty) if empty else ''))
+        rights = self.currentCastlingRight
+        castling = ('K' if rights.wks else '') + ('Q' if rights.wqs else '') + ('k' if rights.bks else '') + ('q' if rights.bqs else '')
+        enpassant = SQUARE_NAMES[self.enpassantPossible[0]*8 + self.enpassantPossible[1]] if self.enpassantPossible else '-'
+        return f"{'/'.join(rows)} {'w' if self.whiteToMove else 'b'} {castling or '-'} {enpassant} {self.getHalfmoveClock()} {self.getFullmoveNumber()}"
+
+    '''plies since the last capture or pawn move'''
+    def getHalfmoveClock(self):
+        for plies, move in enumerate(reversed(self.moveLog)):
+            if move.pieceMoved[1] == 'p' or move.pieceCaptured != '--':
+                return plies
+        return self.startHalfmoveClock + len(self.moveLog)
+
+    '''the fullmove number starts at 1 and goes up after every black move'''
+    def getFullmoveNumber(self):
+        return self.startFullmoveNumber + (len(self.moveLog) + (0 if self.startWhiteToMove else 1))//2
+
+    '''
+    set up the position of a FEN string, the move history starts over from it
+    '''
+    def loadFen(self, fen):
+        fields = fen.split()
+        self.board = []
+        for fenRow in fields[0].split('/'):
+            row = []
+            for char in fenRow:
+                if char.isdigit():
+                    row.extend(['--'] * int(char))
+                else:
+                    row.append(FEN_TO_PIECE[char])
+            self.board.append(row)
+        if len(self.board) != 8 or any(len(row) != 8 for row in self.board):
+            raise ValueError(f"invalid FEN board: {fields[0]}")
+        self.whiteToMove = len(fields) < 2 or fields[1] == 'w'
+        castling = fields[2] if len(fields) > 2 else '-'
+        self.currentCastlingRight = CastleRights('K' in castling, 'k' in castling, 'Q' in castling, 'q' in castling)
+        self.enpassantPossible = notationToCoords(fields[3]) if len(fields) > 3 and fields[3] != '-' else ()
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c] == 'wK':
+                    self.whiteKingLocation = (r, c)
+                elif self.board[r][c] == 'bK':
+                    self.blackKingLocation = (r, c)
+        self.startHalfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+        self.startFullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+        self.startWhiteToMove = self.whiteToMove
+        self.moveLog = []
+        self.checkMate = False
+        self.staleMate = False
+        self.castlingRightsLog = [CastleRights(self.currentCastlingRight.wks,self.currentCastlingRight.bks,
+                                               self.currentCastlingRight.wqs,self.currentCastlingRight.bqs)]
+        self.loadBitboards()
+        self.enpassantPossibleLog = [self.enpassantPossible]
+        self.zobristLog = [self.zobristKey]
+        self.validMovesCache = None
+        self.movesByOrigin = None
+
+    '''rebuild every bitboard from self.board (call it after editing self.board by hand)'''
+    def loadBitboards(self):
+        self.pieceBitboards = {piece: 0 for piece in PIECES}
+        self.colorBitboards = {'w': 0, 'b': 0}
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    bit = 1 << (r*8 + c)
+                    self.pieceBitboards[piece] |= bit
+                    self.colorBitboards[piece[0]] |= bit
+        self.occupied = self.colorBitboards['w'] | self.colorBitboards['b']
+        self.zobristKey = self.computeZobristKey()
+
+    '''hash the whole position from scratch, makeMove and undoMove keep self.zobristKey up to date incrementally'''
+    def computeZobristKey(self):
+        key = 0
+        for piece in PIECES:
+            for sq in iterBits(self.pieceBitboards[piece]):
+                key ^= ZOBRIST_PIECES[piece][sq]
+        if not self.whiteToMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        return key ^ castlingKey(self.currentCastlingRight) ^ enpassantKey(self.enpassantPossible)
+
+    '''put a piece on an empty square, keeping the board and the bitboards in sync'''
+    def putPiece(self, r, c, piece):
+        if piece == "--":
+            return
+        bit = 1 << (r*8 + c)
+        self.board[r][c] = piece
+        self.pieceBitboards[piece] |= bit
+        self.colorBitboards[piece[0]] |= bit
+        self.occupied |= bit
+        self.zobristKey ^= ZOBRIST_PIECES[piece][r*8 + c]
+
+    '''remove whatever stands on a square'''
+    def clearSquare(self, r, c):
+        piece = self.board[r][c]
+        if piece != "--":
+            mask = ~(1 << (r*8 + c))
+            self.board[r][c] = "--"
+            self.pieceBitboards[piece] &= mask
+            self.colorBitboards[piece[0]] &= mask
+            self.occupied &= mask
+            self.zobristKey ^= ZOBRIST_PIECES[piece][r*8 + c]
 
 
 # for now it doesn't work for en passant and casteling 
     def makeMove(self, move):
-        self.board[move.startRow][move.startCol] = "--"
-        self.board[move.endRow][move.endCol] = move.pieceMoved
+        self.clearSquare(move.startRow, move.startCol)
+        self.clearSquare(move.endRow, move.endCol) #removes the captured piece if any
         self.moveLog.append(move) #history of moves
         self.whiteToMove = not self.whiteToMove #swap player turns
+        self.zobristKey ^= ZOBRIST_BLACK_TO_MOVE
 
         #pawn promotion Move
         if move.isPawnPromotion: 
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] +'Q'
+            self.putPiece(move.endRow, move.endCol, move.pieceMoved[0] +'Q')
+        else:
+            self.putPiece(move.endRow, move.endCol, move.pieceMoved)
 
         #En passant Move
         if move.isEnpassantMove: 
-            self.board[move.startRow][move.endCol] = '--' #capture the pawn
+            self.clearSquare(move.startRow, move.endCol) #capture the pawn
 
         #Castle Move
         if move.isCastleMove: 
             if move.endCol -move.startCol ==2: #kingside castle
-                self.board[move.endRow][move.endCol-1] =self.board[move.endRow][move.endCol+1] #moves the rook
-                self.board[move.endRow][move.endCol+1] = '--' #erase the old rook
+                rook = self.board[move.endRow][move.endCol+1]
+                self.clearSquare(move.endRow, move.endCol+1) #erase the old rook
+                self.putPiece(move.endRow, move.endCol-1, rook) #moves the rook
             else: #queenside castle
-                self.board[move.endRow][move.endCol+1] =self.board[move.endRow][move.endCol-2] #moves the rook
-                self.board[move.endRow][move.endCol-2] = '--' #erase the old rook
+                rook = self.board[move.endRow][move.endCol-2]
+                self.clearSquare(move.endRow, move.endCol-2) #erase the old rook
+                self.putPiece(move.endRow, move.endCol+1, rook) #moves the rook
         
         #update the king's location if needed
         if move.pieceMoved =='wK': 
@@ -64,15 +330,21 @@ class GameState():
             self.blackKingLocation  = (move.endRow, move.endCol) 
 
         #update enPassant
+        self.zobristKey ^= enpassantKey(self.enpassantPossible)
         if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow)==2:
             self.enpassantPossible = ((move.startRow + move.endRow)//2,move.startCol)
         else:
             self.enpassantPossible = () 
+        self.zobristKey ^= enpassantKey(self.enpassantPossible)
+        self.enpassantPossibleLog.append(self.enpassantPossible)
 
         #update castling rights:
+        self.zobristKey ^= castlingKey(self.currentCastlingRight)
         self.updateCastleRights(move)
+        self.zobristKey ^= castlingKey(self.currentCastlingRight)
         self.castlingRightsLog.append(CastleRights(self.currentCastlingRight.wks,self.currentCastlingRight.bks,
                                                self.currentCastlingRight.wqs,self.currentCastlingRight.bqs))
+        self.zobristLog.append(self.zobristKey)
           
         
 
@@ -81,8 +353,10 @@ class GameState():
         if len(self.moveLog)!=0: 
             move = self.moveLog.pop()
             #opposite of make move
-            self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
+            self.clearSquare(move.endRow, move.endCol)
+            self.putPiece(move.startRow, move.startCol, move.pieceMoved)
+            if not move.isEnpassantMove:
+                self.putPiece(move.endRow, move.endCol, move.pieceCaptured)
             self.whiteToMove = not self.whiteToMove # switch turns
             # update the king's position if needed
             if move.pieceMoved == "wK":
@@ -91,30 +365,34 @@ class GameState():
                 self.blackKingLocation = (move.startRow, move.startCol)
             # undo en passant move
             if move.isEnpassantMove:
-                self.board[move.endRow][move.endCol] = "--"  # leave landing square blank
-                self.board[move.startRow][move.endCol] = move.pieceCaptured
-                self.enpassantPossible = (move.endRow, move.endCol)
-            #undo a 2 square advance
-            if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow)==2:
-                self.enpassantPossible = ()
-            #undo a 2 square advance
+                self.putPiece(move.startRow, move.endCol, move.pieceCaptured) # landing square stays blank
+            #restore the en passant square of the previous position
+            self.enpassantPossibleLog.pop()
+            self.enpassantPossible = self.enpassantPossibleLog[-1]
+            #restore the castling rights
             self.castlingRightsLog.pop() 
-            self.currentCastlingRight = self.castlingRightsLog[-1]
-            #undo a 2 square advance
+            lastRights = self.castlingRightsLog[-1] #copy it so the next move can't edit the log
+            self.currentCastlingRight = CastleRights(lastRights.wks,lastRights.bks,lastRights.wqs,lastRights.bqs)
+            #undo a castle move
             if move.isCastleMove:
                 if move.endCol - move.startCol == 2 : #kingside
-                    self.board[move.endRow][move.endCol+1] =self.board[move.endRow][move.endCol-1] #moves the rook
-                    self.board[move.endRow][move.endCol-1] = '--' 
+                    rook = self.board[move.endRow][move.endCol-1]
+                    self.clearSquare(move.endRow, move.endCol-1)
+                    self.putPiece(move.endRow, move.endCol+1, rook) #moves the rook
                 else: #queenside 
-                    self.board[move.endRow][move.endCol-2] =self.board[move.endRow][move.endCol+1] #moves the rook
-                    self.board[move.endRow][move.endCol+1] = '--' 
+                    rook = self.board[move.endRow][move.endCol+1]
+                    self.clearSquare(move.endRow, move.endCol+1)
+                    self.putPiece(move.endRow, move.endCol-2, rook) #moves the rook
+            #the previous key is still in the log, no need to xor everything back
+            self.zobristLog.pop()
+            self.zobristKey = self.zobristLog[-1]
 
 
     def updateCastleRights(self, move):
-        if move.pieceMoved=='wk':
+        if move.pieceMoved=='wK':
             self.currentCastlingRight.wks=False 
             self.currentCastlingRight.wqs =False
-        elif move.pieceMoved=='bk':
+        elif move.pieceMoved=='bK':
             self.currentCastlingRight.bks=False 
             self.currentCastlingRight.bqs =False
         elif move.pieceMoved=='wR':
@@ -129,176 +407,263 @@ class GameState():
                     self.currentCastlingRight.bqs=False 
                 elif move.startCol == 7: #right Rook
                     self.currentCastlingRight.bks=False 
+        #a rook captured on its starting square can't castle anymore
+        if move.pieceCaptured=='wR' and move.endRow==7:
+            if move.endCol == 0:
+                self.currentCastlingRight.wqs=False
+            elif move.endCol == 7:
+                self.currentCastlingRight.wks=False
+        elif move.pieceCaptured=='bR' and move.endRow==0:
+            if move.endCol == 0:
+                self.currentCastlingRight.bqs=False
+            elif move.endCol == 7:
+                self.currentCastlingRight.bks=False
 
 
     '''all moves without checking if they are valid'''
     def getPossibleMoves(self):
         moves = []
-        for r in range(len(self.board)):
-            for c in range (len(self.board[r])): 
-                turn = self.board[r][c][0]
-                if (turn=='w' and self.whiteToMove) or (turn =='b' and not self.whiteToMove): 
-                    piece = self.board[r][c][1]
-                    self.moveFunctions[piece](r,c, moves) #calls the appropriate function based on the piece type
+        for piece in COLOR_PIECES['w' if self.whiteToMove else 'b']:
+            for sq in iterBits(self.pieceBitboards[piece]):
+                self.moveFunctions[piece[1]](sq >> 3, sq & 7, moves) #calls the appropriate function based on the piece type
         return moves                   
 
-    '''get all pawn moves  and add them to moves'''
-    def getPawnMoves(self, r,c,moves): 
-        if self.whiteToMove: #for white pawns
-            if self.board[r-1][c] == "--": #1 square move
-                moves.append(Move((r,c),(r-1,c),self.board))
-                if r == 6 and self.board[r-2][c] == "--"  : #2 square move
-                    moves.append(Move((r,c),(r-2,c),self.board))
-            if c-1 >=0: #capture to the left
-                if self.board[r-1][c-1][0] == "b" : #if there's an enemy piece to capture
-                    moves.append(Move((r,c),(r-1,c-1),self.board))
-                elif (r-1,c-1)== self.enpassantPossible:
-                    moves.append(Move((r,c),(r-1,c-1),self.board,isEnpassantMove=True))
-
-            if c+1 <=7: #capture to the right
-                if self.board[r-1][c+1][0] == "b" : #if there's an enemy piece to capture
-                    moves.append(Move((r,c),(r-1,c+1),self.board))
-                elif (r-1,c+1)== self.enpassantPossible:
-                    moves.append(Move((r,c),(r-1,c+1),self.board,isEnpassantMove=True))
-        else:
-            if self.board[r+1][c] == "--": #1 square move
-                moves.append(Move((r,c),(r+1,c),self.board))
-                if r == 1 and self.board[r+2][c] == "--"  : #2 square move
-                    moves.append(Move((r,c),(r+2,c),self.board))
-            if c-1 >=0: #capture to the left
-                if self.board[r+1][c-1][0] == "w" : #if there's an enemy piece to capture
-                    moves.append(Move((r,c),(r+1,c-1),self.board))
-                elif (r+1,c-1)== self.enpassantPossible:
-                    moves.append(Move((r,c),(r+1,c-1),self.board,isEnpassantMove=True))
-            if c+1 <=7: #capture to the right
-                if self.board[r+1][c+1][0] == "w" : #if there's an enemy piece to capture
-                    moves.append(Move((r,c),(r+1,c+1),self.board))
-                elif (r+1,c+1)== self.enpassantPossible:
-                    moves.append(Move((r,c),(r+1,c+1),self.board,isEnpassantMove=True))
-
-    def getRookMoves(self, r,c,moves): 
-        directions = ((-1,0),(0,-1),(1,0),(0,1))
-        enemyColor = "b" if self.whiteToMove else "w"
-        for d in directions:
-            for i in range(1,8):
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-                if 0 <= endRow <= 7 and 0 <= endCol <= 7:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece == "--":
-                        moves.append(Move((r,c),(endRow,endCol),self.board))
-                    elif endPiece[0] == enemyColor:
-                        moves.append(Move((r,c),(endRow,endCol),self.board))
-                        break
-                    else:
-                        break
-                else:
-                    break
-
-    def getBishopMoves(self, r,c,moves): 
-        directions = ((-1,-1),(-1,1),(1,-1),(1,1))
-        enemyColor = "b" if self.whiteToMove else "w"
-        for d in directions:
-            for i in range(1,8):
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-                if 0 <= endRow <= 7 and 0 <= endCol <= 7:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece == "--":
-                        moves.append(Move((r,c),(endRow,endCol),self.board))
-                    elif endPiece[0] == enemyColor:
-                        moves.append(Move((r,c),(endRow,endCol),self.board))
-                        break
-                    else:
-                        break
-                else:
-                    break
-
+    '''add a move from (r,c) to every square set in targets'''
+    def addMoves(self, r, c, targets, moves):
+        for sq in iterBits(targets):
+            moves.append(Move((r,c),(sq >> 3, sq & 7),self.board))
 
-    def getKnightMoves(self, r,c,moves): 
-        directions = ((-1,-2),(-1,2),(1,-2),(1,2),(-2,-1),(-2,1),(2,-1),(2,1)) #all possibles directions
-        enemyColor = "b" if self.whiteToMove else "w"
-        for d in directions:
-            endRow = r + d[0] 
-            endCol = c + d[1] 
-            if 0 <= endRow <= 7 and 0 <= endCol <= 7:
-                endPiece = self.board[endRow][endCol]
-                if endPiece == "--":
-                    moves.append(Move((r,c),(endRow,endCol),self.board))
-                if endPiece[0] == enemyColor:
-                    moves.append(Move((r,c),(endRow,endCol),self.board))
-                     
-
-    def getQueenMoves(self, r,c,moves): 
-        self.getRookMoves(r,c,moves) #gets all moves available to a Rook type piece
-        self.getBishopMoves(r,c,moves) #gets all moves available to a Bishop type piece
-
-    def getKingMoves(self, r,c,moves):
-        directions = ((-1,0),(0,-1),(1,0),(0,1),(-1,-1),(-1,1),(1,-1),(1,1))
-        enemyColor = "b" if self.whiteToMove else "w"
-        for d in directions:
-            endRow = r + d[0] 
-            endCol = c + d[1] 
-            if 0 <= endRow <= 7 and 0 <= endCol <= 7:
-                endPiece = self.board[endRow][endCol]
-                if endPiece == "--":
-                    moves.append(Move((r,c),(endRow,endCol),self.board))
-                if endPiece[0] == enemyColor:
-                    moves.append(Move((r,c),(endRow,endCol),self.board))
-
-    def getCastleMoves(self, r, c, moves):
-        if self.squareUnderAttack(r, c):
+    '''
+    get all pawn moves  and add them to moves
+    allowed limits the destination squares (used for pins and check evasions), en passant is checked separately
+    '''
+    def getPawnMoves(self, r,c,moves, allowed=ALL_SQUARES): 
+        if self.whiteToMove: #white pawns move up the board
+            color, enemyColor, step, startRow = 'w', 'b', -1, 6
+        else:
+            color, enemyColor, step, startRow = 'b', 'w', 1, 1
+        if not self.occupied >> ((r+step)*8 + c) & 1: #1 square move
+            if allowed >> ((r+step)*8 + c) & 1:
+                moves.append(Move((r,c),(r+step,c),self.board))
+            if r == startRow and not self.occupied >> ((r+2*step)*8 + c) & 1 and allowed >> ((r+2*step)*8 + c) & 1: #2 square move
+                moves.append(Move((r,c),(r+2*step,c),self.board))
+        attacks = PAWN_ATTACKS[color][r*8 + c]
+        self.addMoves(r, c, attacks & self.colorBitboards[enemyColor] & allowed, moves) #captures
+        if self.enpassantPossible:
+            epRow, epCol = self.enpassantPossible
+            if attacks >> (epRow*8 + epCol) & 1:
+                moves.append(Move((r,c),(epRow,epCol),self.board,isEnpassantMove=True))
+
+    def getRookMoves(self, r,c,moves, allowed=ALL_SQUARES): 
+        own = self.colorBitboards['w' if self.whiteToMove else 'b']
+        self.addMoves(r, c, rookAttacks(r*8 + c, self.occupied) & ~own & allowed, moves)
+
+    def getBishopMoves(self, r,c,moves, allowed=ALL_SQUARES): 
+        own = self.colorBitboards['w' if self.whiteToMove else 'b']
+        self.addMoves(r, c, bishopAttacks(r*8 + c, self.occupied) & ~own & allowed, moves)
+
+    def getKnightMoves(self, r,c,moves, allowed=ALL_SQUARES): 
+        own = self.colorBitboards['w' if self.whiteToMove else 'b']
+        self.addMoves(r, c, KNIGHT_ATTACKS[r*8 + c] & ~own & allowed, moves)
+
+    def getQueenMoves(self, r,c,moves, allowed=ALL_SQUARES): 
+        self.getRookMoves(r,c,moves,allowed) #gets all moves available to a Rook type piece
+        self.getBishopMoves(r,c,moves,allowed) #gets all moves available to a Bishop type piece
+
+    def getKingMoves(self, r,c,moves, allowed=ALL_SQUARES):
+        own = self.colorBitboards['w' if self.whiteToMove else 'b']
+        self.addMoves(r, c, KING_ATTACKS[r*8 + c] & ~own & allowed, moves)
+
+    '''enemyAttacks is the attack map from getValidMoves, computed here when called on its own'''
+    def getCastleMoves(self, r, c, moves, enemyAttacks=None):
+        if enemyAttacks is None:
+            enemyAttacks = self.attackedSquares('b' if self.whiteToMove else 'w')
+        if enemyAttacks >> (r*8 + c) & 1:
             return #can't casle while in check
         if (self.whiteToMove and self.currentCastlingRight.wks) or (not self.whiteToMove and self.currentCastlingRight.bks):
-            self.getKingsideCastleMoves(r, c, moves)
+            self.getKingsideCastleMoves(r, c, moves, enemyAttacks)
         if (self.whiteToMove and self.currentCastlingRight.wqs) or (not self.whiteToMove and self.currentCastlingRight.bqs):
-            self.getQueensideCastleMoves(r, c, moves)
+            self.getQueensideCastleMoves(r, c, moves, enemyAttacks)
 
-    def getKingsideCastleMoves(self, r, c, moves):
-        if c + 2 < 8:  # Check if within board bounds
+    def getKingsideCastleMoves(self, r, c, moves, enemyAttacks):
+        if c + 3 < 8 and self.board[r][c+3] == self.board[r][c][0] + 'R':  # the rook has to still be there
             if self.board[r][c+1]=='--' and self.board[r][c+2]=='--':
-                if not self.squareUnderAttack(r, c+1) and not self.squareUnderAttack(r, c+2):
+                if not enemyAttacks & (0b11 << (r*8 + c+1)):
                     moves.append(Move((r, c), (r, c+2), self.board, isCastleMove=True))
         
-    def getQueensideCastleMoves(self, r, c, moves):
-        if c - 3 >= 0:  # Check if within board bounds
+    def getQueensideCastleMoves(self, r, c, moves, enemyAttacks):
+        if c - 4 >= 0 and self.board[r][c-4] == self.board[r][c][0] + 'R':  # the rook has to still be there
             if self.board[r][c-1]=='--' and self.board[r][c-2]=='--' and self.board[r][c-3]=='--':
-                if not self.squareUnderAttack(r, c-1) and not self.squareUnderAttack(r, c-2):
+                if not enemyAttacks & (0b11 << (r*8 + c-2)):
                     moves.append(Move((r, c), (r, c-2), self.board, isCastleMove=True))
 
-    '''all moves with checking'''
+    '''
+    all moves with checking
+    checkers and pinned pieces are found once, then every generator only emits moves that keep the king safe
+    calling it again on the same position returns the cached list (don't modify it) and restores the checkMate/staleMate flags
+    '''
     def getValidMoves(self): 
-        TempEnpassantPossible = self.enpassantPossible
-        TempCastleRights = CastleRights(self.currentCastlingRight.wks,self.currentCastlingRight.bks,
-                                               self.currentCastlingRight.wqs,self.currentCastlingRight.bqs)
-        #1.) generate all possible moves
-        moves = self.getPossibleMoves()
-        if self.whiteToMove:
-            self.getCastleMoves(self.whiteKingLocation[0],self.whiteKingLocation[1],moves)
-        else:
-            self.getCastleMoves(self.blackKingLocation[0],self.blackKingLocation[1],moves)
-        #2.) for each move, make the move 
-        for i in range (len(moves)-1,-1,-1): #used reverse loop to prevent bugs when removing elements from list 
-            self.makeMove(moves[i])
-        #3.) generate all opponent's moves
-        #4.) for each of your opponent's moves, see if they attack you king
-            self.whiteToMove = not self.whiteToMove
-            if self.inCheck():
-                moves.remove(moves[i]) 
-            self.whiteToMove = not self.whiteToMove #switch back to current 
-            self.undoMove()  #cancels make move
-            if len(moves)==0 :
-                if self.inCheck(): 
-                    self.checkMate= True 
-                else: 
-                    self.staleMate = True
-            else : 
-                self.checkMate =False
-                self.staleMate = False    
-
-        self.enpassantPossible=TempEnpassantPossible
-        self.currentCastlingRight=TempCastleRights
+        cache = self.validMovesCache
+        if cache is not None and cache[0] == self.zobristKey:
+            self.checkMate, self.staleMate = cache[2], cache[3]
+            return cache[1]
+        context = self.getLegalContext()
+        moves = self.getLegalMoves(context)
+        if len(moves)==0 :
+            self.checkMate = context[2] != 0
+            self.staleMate = context[2] == 0
+        else : 
+            self.checkMate =False
+            self.staleMate = False    
+        self.validMovesCache = (self.zobristKey, moves, self.checkMate, self.staleMate)
+        return moves
+
+    '''
+    valid moves of the piece on (r, c) as {(endRow, endCol): move}, the index is built once per position
+    '''
+    def getMovesFrom(self, r, c):
+        moves = self.getValidMoves()
+        if self.movesByOrigin is None or self.movesByOrigin[0] != self.zobristKey:
+            index = {}
+            for move in moves:
+                index.setdefault((move.startRow, move.startCol), {})[(move.endRow, move.endCol)] = move
+            self.movesByOrigin = (self.zobristKey, index)
+        return self.movesByOrigin[1].get((r, c), {})
+
+    '''the valid move from startSq to endSq, or None'''
+    def getValidMove(self, startSq, endSq):
+        return self.getMovesFrom(startSq[0], startSq[1]).get(endSq)
+
+    '''
+    what makes a generated move legal, computed once per position: (kingSq, enemyAttacks, checkers, allowed, pins)
+    the king can go to any square the enemy doesn't attack once the king itself is out of the way,
+    in single check the other pieces have to capture the checker or block it (allowed), in double check allowed is None
+    because only the king moves, and pinned pieces can only slide along the pin
+    '''
+    def getLegalContext(self):
+        color, enemyColor = ('w', 'b') if self.whiteToMove else ('b', 'w')
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        kingSq = kingRow*8 + kingCol
+        enemyAttacks = self.attackedSquares(enemyColor, self.occupied & ~(1 << kingSq))
+        checkers = self.attackersTo(kingSq, enemyColor)
+        if checkers & (checkers - 1):
+            return kingSq, enemyAttacks, checkers, None, {}
+        allowed = checkers | BETWEEN[kingSq][checkers.bit_length() - 1] if checkers else ALL_SQUARES
+        return kingSq, enemyAttacks, checkers, allowed, self.getPins(kingSq, color, enemyColor)
+
+    '''
+    legal moves of every piece of the side to move that land on targets (pawnTargets for pawns)
+    castles and enpassant switch those special moves on or off
+    '''
+    def getLegalMoves(self, context, targets=ALL_SQUARES, pawnTargets=ALL_SQUARES, castles=True, enpassant=True):
+        moves = []
+        for piece in COLOR_PIECES['w' if self.whiteToMove else 'b'][::-1]: #king first
+            for sq in iterBits(self.pieceBitboards[piece]):
+                self.getPieceMoves(context, sq, piece, moves, targets, pawnTargets, castles, enpassant)
         return moves
+
+    def getPieceMoves(self, context, sq, piece, moves, targets=ALL_SQUARES, pawnTargets=ALL_SQUARES, castles=True, enpassant=True):
+        kingSq, enemyAttacks, checkers, allowed, pins = context
+        r, c = sq >> 3, sq & 7
+        if piece[1] == 'K':
+            self.getKingMoves(r, c, moves, ~enemyAttacks & targets)
+            if castles and not checkers:
+                self.getCastleMoves(r, c, moves, enemyAttacks)
+        elif allowed is not None:
+            if piece[1] == 'p':
+                count = len(moves)
+                self.getPawnMoves(r, c, moves, allowed & pawnTargets & pins.get(sq, ALL_SQUARES))
+                #en passant removes two pieces from the board, so it gets a full king safety check
+                if len(moves) > count and moves[-1].isEnpassantMove:
+                    if not enpassant or not self.enpassantIsLegal(moves[-1], kingSq, 'b' if self.whiteToMove else 'w'):
+                        moves.pop()
+            else:
+                self.moveFunctions[piece[1]](r, c, moves, allowed & targets & pins.get(sq, ALL_SQUARES))
+
+    '''
+    the legal move with this moveID, or None (used to check hash and killer moves without generating every move)
+    '''
+    def getMoveByID(self, context, moveID, targets=ALL_SQUARES, pawnTargets=ALL_SQUARES, castles=True):
+        r, c = moveID // 1000, moveID // 100 % 10
+        piece = self.board[r][c]
+        if piece == '--' or piece[0] != ('w' if self.whiteToMove else 'b'):
+            return None
+        moves = []
+        self.getPieceMoves(context, r*8 + c, piece, moves, targets, pawnTargets, castles)
+        for move in moves:
+            if move.moveID == moveID:
+                return move
+        return None
+
+    '''
+    Staged legal move generation for the search: the hash move, then captures and promotions (most valuable victim first),
+    then the killer moves, then the quiet moves. A stage is only generated once the consumer asks for its first move,
+    so a cutoff on the hash move or a capture never builds the quiet moves. capturesOnly stops after the captures (quiescence).
+    hashMove and killers are moveIDs, captureKey and quietKey replace the sort keys of the capture and quiet stages.
+    The consumer has to undo its move before asking for the next one. Unlike getValidMoves the checkMate/staleMate flags aren't set
+    '''
+    def generateMoves(self, hashMove=None, killers=(), capturesOnly=False, captureKey=None, quietKey=None):
+        context = self.getLegalContext()
+        enemy = self.colorBitboards['b' if self.whiteToMove else 'w']
+        promotionRank = RANK_MASKS[0 if self.whiteToMove else 7]
+        captureTargets, pawnCaptureTargets = enemy, enemy | promotionRank
+        emptySquares = ~self.occupied & ALL_SQUARES
+        done = set()
+        if hashMove is not None:
+            if capturesOnly:
+                move = self.getMoveByID(context, hashMove, captureTargets, pawnCaptureTargets, castles=False)
+            else:
+                move = self.getMoveByID(context, hashMove)
+            if move is not None:
+                done.add(hashMove)
+                yield move
+        captures = self.getLegalMoves(context, captureTargets, pawnCaptureTargets, castles=False)
+        captures.sort(key=captureKey or mvvLva, reverse=True)
+        for move in captures:
+            if move.moveID not in done:
+                yield move
+        if capturesOnly:
+            return
+        for killer in killers:
+            if killer is not None and killer not in done:
+                move = self.getMoveByID(context, killer, emptySquares, emptySquares & ~promotionRank)
+                if move is not None and not move.isEnpassantMove:
+                    done.add(killer)
+                    yield move
+        quiets = self.getLegalMoves(context, emptySquares, emptySquares & ~promotionRank, enpassant=False)
+        if quietKey is not None:
+            quiets.sort(key=quietKey, reverse=True)
+        for move in quiets:
+            if move.moveID not in done:
+                yield move
+
+    '''
+    maps each pinned piece's square to the squares it can still move to (the line between the king and the pinner)
+    '''
+    def getPins(self, kingSq, color, enemyColor):
+        bbs = self.pieceBitboards
+        snipers = rookAttacks(kingSq, 0) & (bbs[enemyColor+'R'] | bbs[enemyColor+'Q'])
+        snipers |= bishopAttacks(kingSq, 0) & (bbs[enemyColor+'B'] | bbs[enemyColor+'Q'])
+        pins = {}
+        for sniper in iterBits(snipers):
+            blockers = BETWEEN[kingSq][sniper] & self.occupied
+            if blockers and blockers & (blockers - 1) == 0 and blockers & self.colorBitboards[color]:
+                pins[blockers.bit_length() - 1] = BETWEEN[kingSq][sniper] | (1 << sniper)
+        return pins
+
+    def enpassantIsLegal(self, move, kingSq, enemyColor):
+        capturedBit = 1 << (move.startRow*8 + move.endCol)
+        occupied = (self.occupied ^ (1 << (move.startRow*8 + move.startCol)) ^ capturedBit) | (1 << (move.endRow*8 + move.endCol))
+        bbs = self.pieceBitboards
+        if rookAttacks(kingSq, occupied) & (bbs[enemyColor+'R'] | bbs[enemyColor+'Q']):
+            return False
+        if bishopAttacks(kingSq, occupied) & (bbs[enemyColor+'B'] | bbs[enemyColor+'Q']):
+            return False
+        color = 'w' if enemyColor == 'b' else 'b'
+        if PAWN_ATTACKS[color][kingSq] & bbs[enemyColor+'p'] & ~capturedBit:
+            return False
+        return not KNIGHT_ATTACKS[kingSq] & bbs[enemyColor+'N']
+
     '''
     Determine if player is in check 
     '''
@@ -311,13 +676,43 @@ class GameState():
     Determine if the enemy can attack square r, c
     ''' 
     def squareUnderAttack (self,r,c):
-        self.whiteToMove = not self.whiteToMove #switch to opponent view  
-        oppMoves = self.getPossibleMoves()
-        self.whiteToMove = not self.whiteToMove # switch back to current user 
-        for move in oppMoves: 
-            if move.endRow ==r and move.endCol ==c: #means square under attack 
-                return True
-        return False      
+        enemyColor = 'b' if self.whiteToMove else 'w'
+        return self.attackersTo(r*8 + c, enemyColor) != 0
+
+    '''
+    Bitboard of the pieces of the given color that attack square sq
+    '''
+    def attackersTo(self, sq, color, occupied=None):
+        if occupied is None:
+            occupied = self.occupied
+        bbs = self.pieceBitboards
+        #a pawn attacks sq if a pawn of the other color standing on sq would attack the pawn
+        attackers = PAWN_ATTACKS['b' if color == 'w' else 'w'][sq] & bbs[color+'p']
+        attackers |= KNIGHT_ATTACKS[sq] & bbs[color+'N']
+        attackers |= KING_ATTACKS[sq] & bbs[color+'K']
+        attackers |= rookAttacks(sq, occupied) & (bbs[color+'R'] | bbs[color+'Q'])
+        attackers |= bishopAttacks(sq, occupied) & (bbs[color+'B'] | bbs[color+'Q'])
+        return attackers
+
+    '''
+    Bitboard of every square attacked by the given color
+    '''
+    def attackedSquares(self, color, occupied=None):
+        if occupied is None:
+            occupied = self.occupied
+        bbs = self.pieceBitboards
+        attacks = 0
+        for sq in iterBits(bbs[color+'p']):
+            attacks |= PAWN_ATTACKS[color][sq]
+        for sq in iterBits(bbs[color+'N']):
+            attacks |= KNIGHT_ATTACKS[sq]
+        for sq in iterBits(bbs[color+'K']):
+            attacks |= KING_ATTACKS[sq]
+        for sq in iterBits(bbs[color+'R'] | bbs[color+'Q']):
+            attacks |= rookAttacks(sq, occupied)
+        for sq in iterBits(bbs[color+'B'] | bbs[color+'Q']):
+            attacks |= bishopAttacks(sq, occupied)
+        return attacks
 
 
 class CastleRights():
@@ -331,6 +726,9 @@ class CastleRights():
        
     
 class Move():
+    #no per-instance __dict__: thousands of moves are built per search, slots make them smaller and faster to create
+    __slots__ = ('startRow', 'startCol', 'endRow', 'endCol', 'pieceMoved', 'pieceCaptured',
+                 'isPawnPromotion', 'isEnpassantMove', 'isCastleMove', 'moveID')
 
     #maps keys to values (key : value)
     ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4,
@@ -341,10 +739,8 @@ class Move():
     colsToFiles = {v: k for k, v in filesToCols.items()}
 
     def __init__(self, startSq, endSq, board, isEnpassantMove = False, isCastleMove= False):
-        self.startRow= startSq[0]
-        self.startCol= startSq[1]
-        self.endRow= endSq[0]
-        self.endCol= endSq[1]
+        self.startRow, self.startCol = startSq
+        self.endRow, self.endCol = endSq
         self.pieceMoved= board[self.startRow][self.startCol]
         self.pieceCaptured= board[self.endRow][self.endCol]
         
@@ -369,9 +765,40 @@ class Move():
             return self.moveID== other.moveID
         return False
 
+    def __hash__(self):
+        return self.moveID
+
+    '''pawns always promote to a queen'''
+    @property
+    def promotionPiece(self):
+        return self.pieceMoved[0] + 'Q' if self.isPawnPromotion else None
+
+    '''
+    the whole move in one int: from square (bits 0-5), to square (6-11), en passant, castle and promotion flags (12-14),
+    moved piece (15-18) and captured piece (19-22) as PIECE_CODES; fromPacked rebuilds the move without a board
+    '''
+    @property
+    def packed(self):
+        return ((self.startRow*8 + self.startCol) | (self.endRow*8 + self.endCol) << 6 |
+                self.isEnpassantMove << 12 | self.isCastleMove << 13 | self.isPawnPromotion << 14 |
+                PIECE_CODES[self.pieceMoved] << 15 | PIECE_CODES[self.pieceCaptured] << 19)
+
+    @staticmethod
+    def fromPacked(packed):
+        move = Move.__new__(Move)
+        startSq, endSq = packed & 63, packed >> 6 & 63
+        move.startRow, move.startCol = startSq >> 3, startSq & 7
+        move.endRow, move.endCol = endSq >> 3, endSq & 7
+        move.isEnpassantMove = bool(packed >> 12 & 1)
+        move.isCastleMove = bool(packed >> 13 & 1)
+        move.isPawnPromotion = bool(packed >> 14 & 1)
+        move.pieceMoved = CODE_PIECES[packed >> 15 & 15]
+        move.pieceCaptured = CODE_PIECES[packed >> 19 & 15]
+        move.moveID = move.startRow*1000 + move.startCol*100 + move.endRow*10 + move.endCol
+        return move
     
     def getChessNotation(self):
-        return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        return SQUARE_NAMES[self.startRow*8 + self.startCol] + SQUARE_NAMES[self.endRow*8 + self.endCol]
 
     def getRankFile(self,r,c):
-        return self.colsToFiles[c] + self.rowsToRanks[r]
\ No newline at end of file
+        return self.colsToFiles[c] + self.rowsToRanks[r]
@@ -1,14 +1,16 @@
 import pygame as p
 import sys
+import random
 import chessEngine
-import chess
-from Model.opponent import Model_makeMove
+import chessAI
 from button import Button
+import assetCache
 
 WIDTH  = HEIGHT = 640
 DIMENSION = 8  # dimensions of a chess board are 8*8
 SQ_SIZE =HEIGHT // DIMENSION
 MAX_FPS = 15 #for animations later on 
+PONDER = True #let the AI keep searching on the player's time, within the budget of its difficulty
 IMAGES = {}
 
 '''
@@ -16,105 +18,38 @@ initialize a global dictionary of images to make it easy to change after
 '''
 
 def loadImages (): 
-    pieces = ['wp','wR', 'wN','wB','wK','wQ','bp','bR','bN','bB','bK','bQ']
-    for piece in pieces: 
-        IMAGES [piece] = p.transform.scale(p.image.load("images/"+piece +".png"), (SQ_SIZE,SQ_SIZE))
+    IMAGES.update(assetCache.getPieceImages(SQ_SIZE)) #loaded, converted and scaled only the first time
+
 '''
-The main driver for our code. This will handle user input and update the graphics
+the AI's move is searched on a background thread (chessAI.AIWorker) and the game loop only polls for it,
+so the window keeps redrawing at MAX_FPS however long the engine thinks
+the worker searched a copy of the game, so the matching move of the real game is played
 '''
-
-def array_to_fen(board):
-    # Dictionary to convert piece notation
-    piece_conversion = {
-        'bR': 'r', 'bN': 'n', 'bB': 'b', 'bQ': 'q', 'bK': 'k',
-        'wR': 'R', 'wN': 'N', 'wB': 'B', 'wQ': 'Q', 'wK': 'K',
-        'bp': 'p', 'wp': 'P', '--': ''
-    }
-    
-    fen_parts = []
-    
-    # Convert board position
-    for row in board:
-        empty_count = 0
-        fen_row = ''
-        
-        for piece in row:
-            if piece == '--':
-                empty_count += 1
+def modelMove(gs,validMoves,move,info):
+    for validMove in validMoves:
+        if validMove == move:
+            if 'error' in info:
+                print(f"AI's move: {move.getChessNotation()} (random, the search failed: {info['error']})")
             else:
-                if empty_count > 0:
-                    fen_row += str(empty_count)
-                    empty_count = 0
-                fen_row += piece_conversion[piece]
-        
-        if empty_count > 0:
-            fen_row += str(empty_count)
-            
-        fen_parts.append(fen_row)
-    
-    # Join rows with '/'
-    position = '/'.join(fen_parts)
-    
-    # Add additional FEN fields (assuming initial position)
-    # Active color: w (White to move)
-    # Castling availability: KQkq (All castling rights available)
-    # En passant target square: - (No en passant possible)
-    # Halfmove clock: 0
-    # Fullmove number: 1
-    return f"{position} b KQkq - 0 1"
-
-def chess_to_coords(move):
-    """
-    Convert chess notation (e.g. 'a2a3') to list of coordinates [(from_row, from_col), (to_row, to_col)]
-    
-    Args:
-        move (str): Move in chess notation (e.g. 'a2a3')
-        
-    Returns:
-        list: List containing two tuples of (row, col) coordinates
-    """
-    # Chess files (columns) mapping: a-h -> 0-7
-    files = {'a': 0, 'b': 1, 'c': 2, 'd': 3, 'e': 4, 'f': 5, 'g': 6, 'h': 7}
-    
-    # Extract components of the move
-    from_file = move[0]  # First character (file)
-    from_rank = int(move[1])  # Second character (rank)
-    to_file = move[2]    # Third character (file)
-    to_rank = int(move[3])  # Fourth character (rank)
-    
-    # Convert to board coordinates (0-7, 0-7)
-    # Subtract rank from 8 because board coordinates are zero-based from the top
-    from_coords = (8 - from_rank, files[from_file])
-    to_coords = (8 - to_rank, files[to_file])
-    
-    return [from_coords, to_coords]
-
-def modelMove(gs,validMoves,difficulty):
-    if(validMoves != []):
-        ModelMove= Model_makeMove(array_to_fen(gs.board),difficulty)
-        playerClicks=chess_to_coords(str(ModelMove))
-
-        print(f"Model's move: {ModelMove} aka {playerClicks}")
-
-        move = chessEngine.Move(playerClicks[0],playerClicks[1],gs.board)
-
-        for i in range(len(validMoves)):
-            if move == validMoves[i]:
-                gs.makeMove(validMoves[i])
-                moveMade = True
-                animate = True 
-                sqSelected =() #reset for next move
-                playerClicks=[]  
+                print(f"AI's move: {move.getChessNotation()} (depth {info['depth']}, {info['nodes']} nodes, {info['nps']} nodes/s)")
+            gs.makeMove(validMove)
+            return True
+    return False
+'''
+The main driver for our code. This will handle user input and update the graphics
+'''
 def start_Game (screen,clock,local=True,difficulty=0):
     p.init()
     screen.fill((0, 0, 0))
     screen.fill(p.Color("white"))
     gs = chessEngine.GameState()
+    aiWorker = None if local else chessAI.AIWorker() #the AI plays black
     print("this is checkmate ", gs.checkMate)
     validMoves = gs.getValidMoves()
     moveMade = False 
     animate  = False #flag variable for when we want to animate
     loadImages() #only do this once to avoid performence issues  
+    renderer = BoardRenderer(screen)
     running = True 
     sqSelected =() #no square is selected initialy, to keep track of the last mouse click : (row,col)
     playerClicks=[] #keep track of player clicks : [(6,4),(4,4)]
@@ -125,9 +60,11 @@ def start_Game (screen,clock,local=True,difficulty=0):
                 running = False
                 p.quit()
                 sys.exit()    
+            elif e.type in (p.WINDOWEXPOSED, p.VIDEOEXPOSE): #uncovered or restored, the window's contents may be gone
+                renderer.invalidate() #so the next draw() sends every square again
             #mouse handler
             elif e.type == p.MOUSEBUTTONDOWN:
-                if not gameOver:
+                if not gameOver and (local or gs.whiteToMove): #no clicks while the AI is thinking
                     location = p.mouse.get_pos() #(x,y) position of the mouse
                     col = location[0]//SQ_SIZE
                     row = location[1]//SQ_SIZE
@@ -140,178 +77,230 @@ def start_Game (screen,clock,local=True,difficulty=0):
                         print("plus 1 click")
                     if len(playerClicks)==2: #after the second click
                         print("vzezevzv")
-                        move = chessEngine.Move(playerClicks[0],playerClicks[1],gs.board)
-                        print(move.getChessNotation())
-
-                        for i in range(len(validMoves)):
-                            if move == validMoves[i]:
-                                gs.makeMove(validMoves[i])
-                                moveMade = True
-                                animate = True 
-                                sqSelected =() #reset for next move
-                                playerClicks=[]
-                            if not moveMade:
-                                playerClicks=[sqSelected]
+                        move = gs.getValidMove(playerClicks[0],playerClicks[1]) #None if the clicks aren't a valid move
+                        if move is not None:
+                            print(move.getChessNotation())
+                            gs.makeMove(move)
+                            moveMade = True
+                            animate = True 
+                            sqSelected =() #reset for next move
+                            playerClicks=[]
+                        else:
+                            playerClicks=[sqSelected]
   
 
             #if user click on z it undos move             
             elif e.type == p.KEYDOWN:
                 if e.key ==p.K_z: 
+                    if aiWorker is not None:
+                        aiWorker.cancel() #the position it is searching is gone
                     gs.undoMove()
+                    if not local and not gs.whiteToMove:
+                        gs.undoMove() #take back the AI's reply too, so it's the player's turn again
                     moveMade = True
                     animate = False
+                    gameOver = False
                 if e.key ==p.K_r: #reset the board when 'r' is pressed 
+                    if aiWorker is not None:
+                        aiWorker.cancel()
                     gs = chessEngine.GameState()
                     validMoves = gs.getValidMoves()
                     sqSelected = ()
                     playerClicks = []
                     moveMade = False 
                     animate = False 
+                    gameOver = False
 
-        if moveMade and not gameOver and not local:
-            print("this los checkmators", gs.checkMate)  
+        if moveMade:
             if animate:
-                animateMove(gs.moveLog[-1], screen, gs.board, clock)
-            validMoves = gs.getValidMoves()
-            print(validMoves)
-            modelMove(gs,validMoves,difficulty)
-            validMoves = gs.getValidMoves()
-            moveMade = False
-            animate = False
-        else:
+                renderer.animateMove(gs.moveLog[-1], gs.board, clock)
             validMoves = gs.getValidMoves()
             moveMade = False
             animate = False
+        elif not local and not gameOver and not gs.whiteToMove:
+            if not aiWorker.thinking:
+                aiWorker.start(gs, **chessAI.DIFFICULTY_BUDGETS[difficulty]) #the difficulty picks the search budget
+            else:
+                move = aiWorker.poll()
+                if move is None and not aiWorker.thinking and validMoves: #the search failed, keep the game going
+                    move = random.choice(validMoves)
+                if move is not None and modelMove(gs,validMoves,move,aiWorker.lastInfo):
+                    moveMade = True
+                    animate = True
+                    if PONDER: #same budget as the AI's own searches, so pondering never plays above the difficulty
+                        aiWorker.ponder(gs, **chessAI.DIFFICULTY_BUDGETS[difficulty])
                     
 
-        drawGameState(screen, gs,validMoves, sqSelected)
+        message = None
         if gs.checkMate: 
             gameOver = True 
-            print("checkmate Baby")
             if gs.whiteToMove:
-                drawText(screen, 'Black wins by checkmate')
+                message = 'Black wins by checkmate'
             else : 
-                drawText (screen, 'White wins by checkmate')
+                message = 'White wins by checkmate'
         elif gs.staleMate:
             gameOver = True 
-            drawText(screen , 'Stalemate')                    
+            message = 'Stalemate'
+        dirty = renderer.draw(gs, sqSelected, message)
         clock.tick(MAX_FPS)
-        p.display.flip() 
+        if dirty:
+            p.display.update(dirty) #only the squares that changed
                    
 def main(): 
     p.init()
     clock = p.time.Clock() 
     screen = p.display.set_mode((WIDTH, HEIGHT))
     clock = p.time.Clock()
+    assetCache.preload(SQ_SIZE)
     main_menu(screen,clock)
 
 def drawText(screen, text):
-        font = p.font.SysFont("Helvitica", 32, True, False)
-        textObject = font.render (text, 0, p.Color('Gray'))
+        font = assetCache.getSysFont("Helvitica", 32, True, False)
+        textObject = assetCache.renderText(font, text, p.Color('Gray'), False)
         textLocation = p.Rect (0,0,WIDTH,HEIGHT).move(WIDTH/2-textObject.get_width()/2, HEIGHT/2-textObject.get_height()/2)
         screen.blit(textObject, textLocation)
-        textObject = font.render (text, 0 , p.Color("Black"))
+        textObject = assetCache.renderText(font, text, p.Color("Black"), False)
         screen.blit(textObject, textLocation.move(2,2))            
+        return textLocation.inflate(4, 4) #the area drawn over, shadow included
 
 '''
 Highlighting for valid moves for better ui 
+returns {(row, col): 'selected' or 'target'} for the squares to tint
 '''
-def highlightSquares (screen, gs, validMoves, sqSelected):
+def highlightSquares (gs, sqSelected):
+    highlights = {}
     if sqSelected !=(): 
         r , c = sqSelected
         if gs.board[r][c][0] == ('w' if gs.whiteToMove else 'b'): #sqSelected is a piece that can be moved
-            #highlight selected course
-            s = p.Surface ((SQ_SIZE,SQ_SIZE))
-            s.set_alpha(100) #transparency value -> 0 transparent; 255 opaque
-            s.fill(p.Color('blue'))
-            screen.blit(s,(c*SQ_SIZE,r*SQ_SIZE))
+            highlights[(r, c)] = 'selected'
             #highlight moves from that squares
-            s.fill(p.Color('yellow'))
-            for move in validMoves: 
-                if move.startRow == r and move.startCol ==c: 
-                    screen.blit(s,(SQ_SIZE*move.endCol,SQ_SIZE*move.endRow))
-
-
+            for endSq in gs.getMovesFrom(r, c): 
+                highlights[endSq] = 'target'
+    return highlights
+
+BOARD_COLORS = [p.Color("white"), p.Color("gray")] #if r+c modulo 2 equals 0 it uses white color, if it s 1 it uses gray
+HIGHLIGHT_COLORS = {'selected': p.Color('blue'), 'target': p.Color('yellow')}
+
+class BoardRenderer():
+    '''
+    Responsible for all the graphics within a current game state. 
+    The empty board is rendered once and the highlight surfaces are made once, then every frame only the squares
+    whose piece or highlight changed are redrawn, and draw() returns their rects for p.display.update
+    (an idle board sends nothing to the display)
+    '''
+    def __init__(self, screen):
+        self.screen = screen
+        self.boardSurface = p.Surface((WIDTH, HEIGHT)).convert()
+        drawBoard(self.boardSurface)
+        self.highlights = {}
+        for name, color in HIGHLIGHT_COLORS.items():
+            s = p.Surface((SQ_SIZE, SQ_SIZE)).convert()
+            s.set_alpha(100) #transparency value -> 0 transparent; 255 opaque
+            s.fill(color)
+            self.highlights[name] = s
+        self.message = None
+        self.messageRect = None
+        self.invalidate()
+
+    '''forget what is on the screen, the next draw() repaints every square'''
+    def invalidate(self):
+        self.drawn = [[None]*DIMENSION for _ in range(DIMENSION)] #(piece, highlight) as last drawn on each square
+
+    def drawSquare(self, r, c, piece, highlight):
+        rect = p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        self.screen.blit(self.boardSurface, rect, rect)
+        if highlight is not None:
+            self.screen.blit(self.highlights[highlight], rect)
+        if piece != "--":
+            self.screen.blit(IMAGES[piece], rect)
+        self.drawn[r][c] = (piece, highlight)
+        return rect
+
+    '''draws the changed squares and the message (e.g. checkmate) on top, returns the dirty rects'''
+    def draw(self, gs, sqSelected, message=None):
+        if message != self.message and self.messageRect is not None:
+            self.invalidate() #the old message has to be painted over
+        highlights = highlightSquares(gs, sqSelected)
+        dirty = []
+        for r in range(DIMENSION):
+            for c in range(DIMENSION):
+                piece, highlight = gs.board[r][c], highlights.get((r, c))
+                if self.drawn[r][c] != (piece, highlight):
+                    dirty.append(self.drawSquare(r, c, piece, highlight))
+        if message is not None and (message != self.message or self.messageRect.collidelist(dirty) != -1):
+            self.messageRect = drawText(self.screen, message)
+            dirty.append(self.messageRect)
+        elif message is None:
+            self.messageRect = None
+        self.message = message
+        return dirty
+
+    '''
+    animating a move 
+    the board behind the moving piece is drawn once, each frame only the piece's old and new rects are updated
+    '''
+    def animateMove(self, move, board, clock):
+        #the board without highlights, the piece moved erased from it's ending square and the captured piece drawn back
+        endPiece = move.pieceCaptured if not move.isEnpassantMove else "--"
+        if self.messageRect is not None:
+            self.invalidate() #paint over the message too
+        dirty = []
+        for r in range(DIMENSION):
+            for c in range(DIMENSION):
+                piece = endPiece if (r, c) == (move.endRow, move.endCol) else board[r][c]
+                if self.drawn[r][c] != (piece, None):
+                    dirty.append(self.drawSquare(r, c, piece, None))
+        self.drawn[move.endRow][move.endCol] = None #shows the moving piece when the animation ends
+        background = self.screen.copy()
+        p.display.update(dirty)
+        dR = move.endRow -move.startRow
+        dC = move.endCol - move.startCol
+        framesPerSquare = 10 #frames to move one square 
+        frameCount = (abs(dR)+ abs(dC)*framesPerSquare)
+        previous = p.Rect(move.startCol*SQ_SIZE, move.startRow*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        for frame in range (frameCount+1): 
+            r,c = (move.startRow + dR*frame/frameCount, move.startCol + dC*frame/frameCount)
+            current = p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+            self.screen.blit(background, previous, previous)
+            #dreaw moving piece 
+            self.screen.blit(IMAGES[move.pieceMoved], current)
+            p.display.update([previous, current])
+            previous = current
+            clock.tick(60)
+        self.message = None
+        self.messageRect = None
 
-'''
-Responsible for all the graphics within a current game state. 
-'''        
-def drawGameState(screen, gs,validMoves,sqSelected):
-    screen.fill(p.Color("white"))
-    drawBoard(screen)
-    highlightSquares(screen, gs, validMoves, sqSelected)
-    drawPieces (screen , gs.board)
 '''
 Draw the squares on the board
 '''
 def drawBoard(screen): 
-    global colors
-    colors = [p.Color("white"), p.Color("gray")]
     for r in range (DIMENSION): 
         for c in range(DIMENSION):
-           color =  colors[((r+c)%2)] #if r+c modulo 2 equals  0 it uses white color, if it s 1 it uses black color because black is always odd and white is pair 
+           color =  BOARD_COLORS[((r+c)%2)]
            p.draw.rect(screen,color,p.Rect((c*SQ_SIZE,r*SQ_SIZE, SQ_SIZE,SQ_SIZE)))
 
-'''
-Draw the pieces on the board using the  current GameState.board
-
-'''
-def drawPieces(screen, board): 
-    for r in range (DIMENSION):
-        for c in range(DIMENSION): 
-            piece = board[r][c] 
-            if (piece != "--"):
-                screen.blit(IMAGES[piece],p.Rect((c*SQ_SIZE,r*SQ_SIZE, SQ_SIZE,SQ_SIZE)))
-
-'''
-animating a move 
-'''
-def animateMove (move, screen, board, clock):
-    global colors
-    coords = [] #list of coords that the animation will move through 
-    dR = move.endRow -move.startRow
-    dC = move.endCol - move.startCol
-    framesPerSquare = 10 #frames to move one square 
-    frameCount = (abs(dR)+ abs(dC)*framesPerSquare)
-    for frame in range (frameCount+1): 
-        r,c = (move.startRow + dR*frame/frameCount, move.startCol + dC*frame/frameCount)
-        drawBoard(screen)
-        drawPieces(screen,board)
-        #erase the piece moved from it's ending square
-        color = colors [(move.endRow + move.endCol)%2]
-        endSquare = p.Rect(move.endCol*SQ_SIZE, move.endRow*SQ_SIZE, SQ_SIZE, SQ_SIZE)
-        p.draw.rect (screen, color, endSquare)
-        #draw captured piece onto rectangle 
-        if move.pieceCaptured != '--': 
-            screen.blit (IMAGES[move.pieceCaptured], endSquare)
-        #dreaw moving piece 
-        screen.blit(IMAGES[move.pieceMoved], p.Rect(c*SQ_SIZE,r*SQ_SIZE, SQ_SIZE,SQ_SIZE))
-        p.display.flip()
-        clock.tick(60)
-        
-
 
-BG = p.image.load("assets/background.jpg")
 def get_font(size): # Returns Press-Start-2P in the desired size
-    return p.font.Font("assets/font.ttf", size)
+    return assetCache.getFont(size)
+
+def menuButton(pos, text):
+    return Button(image = None, pos=pos, 
+                  text_input=text, font=get_font(35), base_color="White", hovering_color="#d7fcd4")
 
 def main_menu(screen, clock):
     p.display.set_caption("Menu")
+    BG = assetCache.getImage("assets/background.jpg", alpha=False)
+    MENU_TEXT = assetCache.renderText(get_font(50), "MAIN MENU", "#b68f40")
+    MENU_RECT = MENU_TEXT.get_rect(center=(320, 100))
+    #the buttons are made once, they only re-render their text when the hover state changes
+    PLAY_BUTTON = menuButton((320, 250), "LOCAL PLAY")
+    OPTIONS_BUTTON = menuButton((320, 400), "VERSUS AI")
+    QUIT_BUTTON = menuButton((320, 550), "QUIT ")
     while True:
         screen.blit(BG, (0, 0))
 
         MENU_MOUSE_POS = p.mouse.get_pos()
 
-        MENU_TEXT = get_font(50).render("MAIN MENU", True, "#b68f40")
-        MENU_RECT = MENU_TEXT.get_rect(center=(320, 100))
-
-        PLAY_BUTTON = Button(image = None, pos=(320, 250), 
-                            text_input="LOCAL PLAY", font=get_font(35), base_color="White", hovering_color="#d7fcd4")
-        OPTIONS_BUTTON = Button(image = None, pos=(320, 400), 
-                            text_input="VERSUS AI", font=get_font(35), base_color="White", hovering_color="#d7fcd4")
-        QUIT_BUTTON = Button(image = None, pos=(320, 550), 
-                            text_input="QUIT ", font=get_font(35), base_color="White", hovering_color="#d7fcd4")
-
         screen.blit(MENU_TEXT, MENU_RECT)
 
         for button in [PLAY_BUTTON, OPTIONS_BUTTON, QUIT_BUTTON]:
@@ -332,20 +321,20 @@ def main_menu(screen, clock):
                     sys.exit()
 
         p.display.update()
+        clock.tick(MAX_FPS) #an idle menu would otherwise redraw as fast as the CPU allows
 
 def ai_menu(screen, clock):
     # p.display.set_caption("ididb")
-    # BG = p.image.load("assets/Background.jpg")
-    sans = p.image.load("assets/sans.png")
-    napstablook = p.image.load("assets/napstablook.jpeg")
-    mettatone = p.image.load ("assets/mettatone.png")
-    mettatone = p.transform.scale(mettatone, (60,60))
-    napstablook = p.transform.scale(napstablook, (45,45))
-
-    sans = p.transform.scale(sans,(50,50))
-    p.init()
+    BG = assetCache.getImage("assets/background.jpg", alpha=False)
+    sans = assetCache.getImage("assets/sans.png", (50,50))
+    napstablook = assetCache.getImage("assets/napstablook.jpeg", (45,45))
+    mettatone = assetCache.getImage("assets/mettatone.png", (60,60))
+    MENU_TEXT = assetCache.renderText(get_font(50), "Difficulty", "#b68f40")
+    MENU_RECT = MENU_TEXT.get_rect(center=(320, 100))
+    EASY_BUTTON = menuButton((320, 250), "EASY")
+    NORMAL_BUTTON = menuButton((320, 400), "NORMAL")
+    HARD_BUTTON = menuButton((320, 550), "HARD")
     while True:
-        screen.fill((0, 0, 0))
         screen.blit(BG, (0, 0))
         screen.blit(napstablook, (170,220))
         screen.blit(mettatone, (150,370))
@@ -353,16 +342,6 @@ def ai_menu(screen, clock):
 
         MENU_MOUSE_POS = p.mouse.get_pos()
 
-        MENU_TEXT = get_font(50).render("Difficulty", True, "#b68f40")
-        MENU_RECT = MENU_TEXT.get_rect(center=(320, 100))
-
-        EASY_BUTTON = Button(image = None, pos=(320, 250), 
-                            text_input="EASY", font=get_font(35), base_color="White", hovering_color="#d7fcd4")
-        NORMAL_BUTTON = Button(image = None, pos=(320, 400), 
-                            text_input="NORMAL", font=get_font(35), base_color="White", hovering_color="#d7fcd4")
-        HARD_BUTTON = Button(image = None, pos=(320, 550), 
-                            text_input="HARD", font=get_font(35), base_color="White", hovering_color="#d7fcd4")
-
         screen.blit(MENU_TEXT, MENU_RECT)
 
         for button in [EASY_BUTTON, NORMAL_BUTTON, HARD_BUTTON]:
@@ -382,7 +361,8 @@ def ai_menu(screen, clock):
                     start_Game(screen,clock,False,2)
                     
 
-        p.display.update()           
+        p.display.update()
+        clock.tick(MAX_FPS)
 
 if __name__ == "__main__":        
     main()
\ No newline at end of file
@@ -0,0 +1,98 @@
+"""Headless API for servers and batch jobs: the engine, FEN conversion, the alpha-beta AI and the neural network opponent #
+   nothing here imports pygame, and torch/python-chess (Model/opponent.py) are only imported by the first modelMove call #
+   moves are UCI strings ('e2e4', 'e7e8q'), positions are FEN strings or chessEngine.GameState objects #
+"""
+import chessEngine
+import chessAI
+
+_searcher = None
+_opponent = None
+
+'''a new game, from the starting position or from fen'''
+def newGame(fen=None):
+    gs = chessEngine.GameState()
+    if fen is not None:
+        gs.loadFen(fen)
+    return gs
+
+def toGameState(position):
+    return newGame(position) if isinstance(position, str) else position
+
+'''UCI notation of an engine move (pawns always promote to a queen)'''
+def moveToUci(move):
+    return move.getChessNotation() + ('q' if move.isPawnPromotion else '')
+
+'''
+the valid move of gs written as UCI, or None
+raises ValueError for an underpromotion (the engine only promotes to a queen) or a promotion without its 'q'
+'''
+def uciToMove(gs, uci):
+    if len(uci) not in (4, 5):
+        raise ValueError(f"invalid UCI move {uci}")
+    if len(uci) == 5 and uci[4] != 'q':
+        raise ValueError(f"unsupported move {uci}: pawns can only promote to a queen")
+    move = gs.getValidMove(chessEngine.notationToCoords(uci[0:2]), chessEngine.notationToCoords(uci[2:4]))
+    if move is not None and move.isPawnPromotion != (len(uci) == 5):
+        raise ValueError(f"{uci} must be written {moveToUci(move)}")
+    return move
+
+def legalMoves(position):
+    return [moveToUci(move) for move in toGameState(position).getValidMoves()]
+
+'''play UCI moves on gs (raises ValueError on an illegal move), returns gs'''
+def playMoves(gs, moves):
+    for uci in moves:
+        move = uciToMove(gs, uci)
+        if move is None:
+            raise ValueError(f"illegal move {uci} in {gs.getFen()}")
+        gs.makeMove(move)
+    return gs
+
+'''
+'checkmate', 'stalemate' or None while the game goes on
+'''
+def gameResult(position):
+    gs = toGameState(position)
+    gs.getValidMoves()
+    if gs.checkMate:
+        return 'checkmate'
+    if gs.staleMate:
+        return 'stalemate'
+    return None
+
+def getSearcher():
+    global _searcher
+    if _searcher is None:
+        _searcher = chessAI.Searcher()
+    return _searcher
+
+'''
+alpha-beta search of the position, returns (UCI move or None, search info with info['move'] as UCI too)
+the budget arguments are those of chessAI.Searcher.findBestMove, difficulty picks chessAI.DIFFICULTY_BUDGETS instead
+'''
+def bestMove(position, timeLimit=1.0, maxDepth=64, maxNodes=None, difficulty=None):
+    budget = chessAI.DIFFICULTY_BUDGETS[difficulty] if difficulty is not None else \
+        {'timeLimit': timeLimit, 'maxDepth': maxDepth, 'maxNodes': maxNodes}
+    searcher = getSearcher()
+    move = searcher.findBestMove(toGameState(position), verbose=False, **budget)
+    uci = moveToUci(move) if move is not None else None
+    return uci, dict(searcher.lastInfo, move=uci)
+
+'''
+Model/opponent.py, imported (with torch) the first time it is needed
+the checkpoints of the difficulties that have one are loaded and warmed up at the same time,
+so a server that calls this at startup doesn't pay for it on its first move
+'''
+def loadOpponent():
+    global _opponent
+    if _opponent is None:
+        from Model import opponent
+        opponent.model_registry.warm_up()
+        _opponent = opponent
+    return _opponent
+
+'''move of the neural network opponent for a difficulty of Model.opponent.MODEL_PATHS, as UCI (None if there is none)'''
+def modelMove(position, difficulty=0):
+    fen = position if isinstance(position, str) else position.getFen()
+    move = loadOpponent().Model_makeMove(fen, difficulty)
+    return move.uci() if move is not None else None
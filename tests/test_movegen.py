@@ -0,0 +1,101 @@
+"""Regression tests of the legal move generators (GameState.getValidMoves and the staged GameState.generateMoves) #
+   perft counts of standard positions, and a move by move cross-check against python-chess over random games #
+   run with pytest from the repository root, or directly: python tests/test_movegen.py #
+"""
+import os
+import sys
+import random
+import chess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import chessEngine
+
+#(FEN, depth, number of leaf nodes), positions from the chess programming wiki's perft results
+#the engine only promotes to a queen, so no promotion can happen within these depths
+PERFT_POSITIONS = [
+    ("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1", 3, 8902),
+    ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", 2, 2039), #castling, pins, en passant
+    ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", 3, 2812), #en passant discovered checks along the rank
+]
+
+def perft(gs, depth):
+    if depth == 0:
+        return 1
+    nodes = 0
+    for move in gs.getValidMoves():
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+'''moves as UCI strings without the promotion piece, the engine's and python-chess's lists are compared as sets'''
+def engineMoves(gs):
+    return {move.getChessNotation() for move in gs.getValidMoves()}
+
+def referenceMoves(board):
+    return {move.uci()[0:4] for move in board.legal_moves}
+
+'''
+the staged generator has to yield exactly the moves of getValidMoves (each once, whatever the hash move and killers are)
+and, with capturesOnly, exactly the captures, promotions and en passant moves
+'''
+def checkStagedGenerator(gs, moves, rng):
+    ids = sorted(move.moveID for move in moves)
+    candidates = [move.moveID for move in moves] + [rng.choice(ids) + 1 if ids else 1] #the last one is rarely legal
+    hashMove = rng.choice(candidates + [None])
+    killers = [rng.choice(candidates + [None]) for _ in range(2)]
+    assert sorted(move.moveID for move in gs.generateMoves(hashMove, killers)) == ids, gs.getFen()
+    tactical = sorted(move.moveID for move in moves if move.pieceCaptured != '--' or move.isPawnPromotion or move.isEnpassantMove)
+    staged = sorted(move.moveID for move in gs.generateMoves(hashMove, killers, capturesOnly=True))
+    assert staged == tactical, gs.getFen()
+
+'''Move.packed keeps everything fromPacked needs to rebuild the move without the board'''
+def checkPackedRoundTrip(moves):
+    for move in moves:
+        rebuilt = chessEngine.Move.fromPacked(move.packed)
+        for name in chessEngine.Move.__slots__:
+            assert getattr(rebuilt, name) == getattr(move, name), (move.getChessNotation(), name)
+        assert rebuilt.promotionPiece == move.promotionPiece
+
+'''
+plays random games on both boards and compares the legal moves of every position, undoing a move pair now and then
+so the undo path is checked as well. Returns the number of positions compared
+'''
+def crossCheck(seed, games, undoProbability=0.2, maxPlies=200):
+    rng = random.Random(seed)
+    positions = 0
+    for _ in range(games):
+        gs = chessEngine.GameState()
+        board = chess.Board()
+        for _ in range(maxPlies):
+            moves = gs.getValidMoves()
+            positions += 1
+            assert engineMoves(gs) == referenceMoves(board), board.fen()
+            assert gs.zobristKey == gs.computeZobristKey(), board.fen()
+            checkStagedGenerator(gs, moves, rng)
+            checkPackedRoundTrip(moves)
+            if not moves:
+                assert gs.checkMate == board.is_checkmate() and gs.staleMate == board.is_stalemate(), board.fen()
+                break
+            move = rng.choice(moves)
+            gs.makeMove(move)
+            board.push_uci(move.getChessNotation() + ('q' if move.isPawnPromotion else ''))
+            if rng.random() < undoProbability and len(board.move_stack) > 1:
+                for _ in range(2):
+                    gs.undoMove()
+                    board.pop()
+    return positions
+
+def test_perft():
+    for fen, depth, expected in PERFT_POSITIONS:
+        gs = chessEngine.GameState()
+        gs.loadFen(fen)
+        assert perft(gs, depth) == expected, fen
+
+def test_cross_check_python_chess():
+    assert crossCheck(seed=1, games=20) > 0
+
+if __name__ == "__main__":
+    test_perft()
+    print("perft ok")
+    print(f"cross-check ok ({crossCheck(seed=1, games=20)} positions)")